@@ -0,0 +1,419 @@
+"""Streaming analytics over saved games and move logs.
+
+Two kinds of records are understood:
+
+* Save files, as written by Game2048.serialize, one game per .state or .txt file.
+* Move logs, with one JSON object per line for each game, like
+  {"grid": [[0, 2, 0, 0], ...], "moves": [["left", 3, 1, 2], ...]},
+  in .jsonl or .log files.
+  The grid is the starting position, and each move is the direction,
+  followed by the x, y and value of the tile spawned afterwards, if any.
+
+Either may be given as plain files, directories, gzip files, or zip and tar
+archives, and other files are skipped. Records are read one at a time, and
+everything is accumulated in a single pass, so memory use doesn't depend on
+the size of the input."""
+
+import argparse
+import json
+import os
+import sys
+import tarfile
+import zipfile
+import zlib
+from collections import Counter
+from multiprocessing import Pool
+
+from .board import MOVE_NAMES, is_lost, max_tile, move, parse_save
+
+LOG_EXTENSIONS = ('.jsonl', '.log')
+SAVE_EXTENSIONS = ('.state', '.txt')
+
+# Large move logs are split into chunks of this many bytes to be analyzed in parallel.
+CHUNK_SIZE = 64 << 20
+
+# Bytes of compressed input read at once.
+READ_SIZE = 1 << 16
+
+
+def _is_log(name):
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return name.endswith(LOG_EXTENSIONS)
+
+
+def _is_save(name):
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return name.endswith(SAVE_EXTENSIONS)
+
+
+def _is_archive(name):
+    return name.endswith(('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2'))
+
+
+def _parse_log_line(line):
+    line = line.strip()
+    if not line:
+        return None
+    game = json.loads(line)
+    moves = []
+    for entry in game['moves']:
+        # The spawned tile is missing when the board filled up.
+        direction, x, y, value = list(entry) + [None] * (4 - len(entry))
+        if not isinstance(direction, int):
+            direction = MOVE_NAMES.index(direction)
+        moves.append((direction, x, y, value))
+    return 'log', {'grid': game['grid'], 'moves': moves}
+
+
+def iter_archive(path):
+    """Yield the records inside a zip or tar archive, one member at a time."""
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.filename.endswith('/'):
+                    for record in _iter_stream(info.filename, archive.open(info)):
+                        yield record
+    else:
+        # Stream mode reads the archive front to back without seeking, which works on compressed tars.
+        with tarfile.open(path, 'r|*') as archive:
+            for info in archive:
+                if info.isfile():
+                    for record in _iter_stream(info.name, archive.extractfile(info)):
+                        yield record
+
+
+def iter_gzip_lines(stream):
+    """Decompress a gzip stream, yielding its lines.
+
+    Unlike gzip.GzipFile, this never seeks, so it works on archive members,
+    which can't seek under Python 2."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pending = b''
+    while True:
+        data = stream.read(READ_SIZE)
+        if not data:
+            break
+        while data:
+            pending += decompressor.decompress(data)
+            # A gzip file may hold several members back to back, and be padded with zeros.
+            data = decompressor.unused_data.lstrip(b'\0')
+            if data:
+                pending += decompressor.flush()
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        lines = pending.split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    pending += decompressor.flush()
+    if pending:
+        yield pending
+
+
+def _iter_stream(name, stream):
+    """Yield the records in a file object, reading move logs line by line."""
+    lines = stream
+    if name.endswith('.gz'):
+        lines = iter_gzip_lines(stream)
+        name = name[:-3]
+    if _is_log(name):
+        for line in lines:
+            record = _parse_log_line(line.decode('utf-8'))
+            if record is not None:
+                yield record
+    elif _is_save(name):
+        # Save extensions are common, so files that aren't saves are skipped rather than fatal.
+        try:
+            text = b''.join(lines).decode('utf-8')
+            if not text.strip():
+                return
+            save = parse_save(text)
+            if len(save['grid']) != 4 or any(len(row) != 4 for row in save['grid']):
+                raise ValueError('the grid is not 4x4')
+        except (ValueError, IndexError) as e:
+            sys.stderr.write('Skipping %s, not a save file: %s\n' % (name, e))
+        else:
+            yield 'save', save
+
+
+def iter_range(path, start, end):
+    """Yield the records of a plain move log whose lines start within [start, end)."""
+    with open(path, 'rb') as f:
+        if start:
+            # Skip the line in progress, the previous chunk owns it.
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            record = _parse_log_line(line.decode('utf-8'))
+            if record is not None:
+                yield record
+
+
+def iter_records(path):
+    """Yield every record in a file, archive, or directory tree."""
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                for record in iter_records(os.path.join(root, name)):
+                    yield record
+    elif _is_archive(path):
+        for record in iter_archive(path):
+            yield record
+    else:
+        with open(path, 'rb') as f:
+            for record in _iter_stream(path, f):
+                yield record
+
+
+def make_tasks(paths, chunk_size=CHUNK_SIZE):
+    """Split the inputs into independent units of work: whole files, or ranges of large move logs."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for task in make_tasks([os.path.join(root, name) for name in sorted(files)], chunk_size):
+                    yield task
+        elif _is_log(path) and not path.endswith('.gz'):
+            size = os.path.getsize(path)
+            for start in range(0, size, chunk_size):
+                yield path, start, min(start + chunk_size, size)
+        else:
+            yield path, None, None
+
+
+def replay(log):
+    """Yield (grid, score, spawned tile as (x, y, value) or None) for every position of a move log.
+
+    The grid yielded is replaced, not modified, by later moves."""
+    grid = [list(row) for row in log['grid']]
+    score = 0
+    yield grid, score, None
+    for direction, x, y, value in log['moves']:
+        grid, gained, _ = move(grid, direction)
+        score += gained
+        if value:
+            grid[y][x] = value
+        yield grid, score, (x, y, value) if value else None
+
+
+def iter_positions(record):
+    """Yield every grid in a record."""
+    kind, data = record
+    if kind == 'save':
+        yield data['grid']
+    else:
+        for grid, score, spawned in replay(data):
+            yield grid
+
+
+def loss_cause(grid):
+    """Classify a lost board by where its largest tile ended up."""
+    count_y, count_x = len(grid), len(grid[0])
+    largest = max_tile(grid)
+    for y, row in enumerate(grid):
+        for x, cell in enumerate(row):
+            if cell == largest:
+                edges = (x in (0, count_x - 1)) + (y in (0, count_y - 1))
+                if edges == 2:
+                    return 'max tile in corner'
+                if edges == 1:
+                    return 'max tile on edge'
+    return 'max tile in centre'
+
+
+class Analysis(object):
+    """Accumulates statistics over records. Partial analyses can be merged."""
+
+    def __init__(self):
+        self.saves = 0
+        self.games = 0
+        self.positions = 0
+        # (x, y, value) -> number of positions with that tile there.
+        self.tiles = Counter()
+        # (x, y, value) -> number of tiles spawned there.
+        self.spawns = Counter()
+        # Sum of scores and number of games, indexed by move number.
+        self.score_sums = []
+        self.score_counts = []
+        self.losses = Counter()
+        self.lost_max_tiles = Counter()
+
+    def _add_position(self, grid):
+        self.positions += 1
+        for y, row in enumerate(grid):
+            for x, cell in enumerate(row):
+                self.tiles[x, y, cell] += 1
+
+    def _add_loss(self, grid):
+        self.losses[loss_cause(grid)] += 1
+        self.lost_max_tiles[max_tile(grid)] += 1
+
+    def add_save(self, save):
+        self.saves += 1
+        self._add_position(save['grid'])
+        if is_lost(save['grid']):
+            self._add_loss(save['grid'])
+
+    def add_log(self, log):
+        self.games += 1
+        for i, (grid, score, spawned) in enumerate(replay(log)):
+            if spawned:
+                self.spawns[spawned] += 1
+            self._add_position(grid)
+            self._add_score(i, score)
+        if is_lost(grid):
+            self._add_loss(grid)
+
+    def _add_score(self, index, score, games=1):
+        if index == len(self.score_sums):
+            self.score_sums.append(0)
+            self.score_counts.append(0)
+        self.score_sums[index] += score
+        self.score_counts[index] += games
+
+    def add(self, record):
+        kind, data = record
+        if kind == 'save':
+            self.add_save(data)
+        else:
+            self.add_log(data)
+
+    def merge(self, other):
+        self.saves += other.saves
+        self.games += other.games
+        self.positions += other.positions
+        self.tiles.update(other.tiles)
+        self.spawns.update(other.spawns)
+        for i, (total, games) in enumerate(zip(other.score_sums, other.score_counts)):
+            self._add_score(i, total, games)
+        self.losses.update(other.losses)
+        self.lost_max_tiles.update(other.lost_max_tiles)
+        return self
+
+    def score_curve(self, step=1):
+        """Returns (move, average score of games still going) for every step moves."""
+        return [(i, self.score_sums[i] / float(self.score_counts[i]))
+                for i in range(0, len(self.score_sums), step)]
+
+    def heatmap(self, value=None):
+        """Returns a grid of how often each cell holds value, or a non-empty tile if None."""
+        cells = set((x, y) for x, y, _ in self.tiles)
+        count_x = max(x for x, y in cells) + 1 if cells else 0
+        count_y = max(y for x, y in cells) + 1 if cells else 0
+        total = float(self.positions or 1)
+        if value is None:
+            return [[1 - self.tiles[x, y, 0] / total for x in range(count_x)] for y in range(count_y)]
+        return [[self.tiles[x, y, value] / total for x in range(count_x)] for y in range(count_y)]
+
+    def to_dict(self):
+        return {
+            'saves': self.saves,
+            'games': self.games,
+            'positions': self.positions,
+            'tiles': [[x, y, value, count] for (x, y, value), count in sorted(self.tiles.items())],
+            'spawns': [[x, y, value, count] for (x, y, value), count in sorted(self.spawns.items())],
+            'score_curve': self.score_curve(),
+            'losses': dict(self.losses),
+            'lost_max_tiles': dict((str(tile), count) for tile, count in self.lost_max_tiles.items()),
+        }
+
+
+def iter_task(task):
+    """Yield the records in one unit of work made by make_tasks."""
+    path, start, end = task
+    return iter_records(path) if start is None else iter_range(path, start, end)
+
+
+def analyze_task(task):
+    """Analyze one unit of work made by make_tasks."""
+    analysis = Analysis()
+    for record in iter_task(task):
+        analysis.add(record)
+    return analysis
+
+
+def analyze(paths, jobs=1, chunk_size=CHUNK_SIZE):
+    """Analyze everything under paths, fanning out over jobs processes if more than one."""
+    tasks = make_tasks(paths, chunk_size)
+    result = Analysis()
+    if jobs == 1:
+        for task in tasks:
+            result.merge(analyze_task(task))
+        return result
+
+    pool = Pool(jobs)
+    try:
+        for analysis in pool.imap_unordered(analyze_task, tasks):
+            result.merge(analysis)
+    finally:
+        pool.close()
+        pool.join()
+    return result
+
+
+def _print_grid(title, grid, fmt='%6.1f%%', scale=100):
+    print(title)
+    for row in grid:
+        print(' '.join(fmt % (cell * scale) for cell in row))
+    print('')
+
+
+def print_report(analysis, step=50):
+    print('Saves: %d, games: %d, positions: %d' % (analysis.saves, analysis.games, analysis.positions))
+    print('')
+    _print_grid('Occupied cells:', analysis.heatmap())
+    largest = max([value for x, y, value in analysis.tiles] or [0])
+    if largest:
+        _print_grid('Cells holding %d:' % largest, analysis.heatmap(largest))
+
+    spawned = sum(analysis.spawns.values())
+    if spawned:
+        fours = sum(count for (x, y, value), count in analysis.spawns.items() if value == 4)
+        print('Spawns: %d, of which 4s: %.1f%%' % (spawned, 100.0 * fours / spawned))
+        count_x = max(x for x, y, value in analysis.spawns) + 1
+        count_y = max(y for x, y, value in analysis.spawns) + 1
+        by_cell = Counter()
+        for (x, y, value), count in analysis.spawns.items():
+            by_cell[x, y] += count
+        _print_grid('Spawn positions:', [[by_cell[x, y] / float(spawned) for x in range(count_x)]
+                                         for y in range(count_y)])
+
+    if analysis.score_sums:
+        print('Average score by move:')
+        for i, score in analysis.score_curve(step):
+            print('%6d %10.1f  (%d games)' % (i, score, analysis.score_counts[i]))
+        print('')
+
+    lost = sum(analysis.losses.values())
+    if lost:
+        print('Losses: %d' % lost)
+        for cause, count in analysis.losses.most_common():
+            print('  %-20s %6d %6.1f%%' % (cause, count, 100.0 * count / lost))
+        print('Max tile at loss:')
+        for tile, count in sorted(analysis.lost_max_tiles.items(), reverse=True):
+            print('  %-20d %6d %6.1f%%' % (tile, count, 100.0 * count / lost))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze saved games and move logs in a single pass.')
+    parser.add_argument('paths', nargs='+', help='save files, move logs, directories or archives')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes to use')
+    parser.add_argument('--step', type=int, default=50, help='moves between points of the score curve')
+    parser.add_argument('--json', action='store_true', help='print the full results as JSON')
+    args = parser.parse_args()
+
+    analysis = analyze(args.paths, args.jobs)
+    if args.json:
+        json.dump(analysis.to_dict(), sys.stdout)
+        print('')
+    else:
+        print_report(analysis, args.step)
+
+
+if __name__ == '__main__':
+    main()
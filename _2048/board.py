@@ -0,0 +1,203 @@
+"""Pure game logic for 2048, independent of pygame.
+
+Grids are lists of rows, indexed as grid[y][x], exactly like Game2048.grid,
+so the functions here can be used on live games, saved games and bots alike."""
+
+import random
+import sys
+
+if sys.version_info[0] < 3:
+    range = xrange
+
+LEFT, RIGHT, UP, DOWN = range(4)
+MOVES = (LEFT, RIGHT, UP, DOWN)
+MOVE_NAMES = ('left', 'right', 'up', 'down')
+
+
+def new_grid(count_x=4, count_y=4, rng=random):
+    """Create a fresh grid with two tiles spawned, like a new game."""
+    grid = [[0] * count_x for _ in range(count_y)]
+    spawn(grid, 2, rng)
+    return grid
+
+
+def free_cells(grid):
+    """Returns a list of empty cells as (x, y)."""
+    return [(x, y)
+            for x in range(len(grid[0]))
+            for y in range(len(grid))
+            if not grid[y][x]]
+
+
+def spawn(grid, count=1, rng=random):
+    """Spawn some new tiles in place, returning them as (x, y, value)."""
+    free = free_cells(grid)
+    spawned = []
+    for x, y in rng.sample(free, min(count, len(free))):
+        value = grid[y][x] = rng.randint(0, 10) and 2 or 4
+        spawned.append((x, y, value))
+    return spawned
+
+
+def _merge_line(line):
+    """Slide a single line towards index 0, returning the new line and the score gained."""
+    tiles = [cell for cell in line if cell]
+    merged = []
+    gained = 0
+    i = 0
+    while i < len(tiles):
+        if i + 1 < len(tiles) and tiles[i] == tiles[i + 1]:
+            merged.append(tiles[i] * 2)
+            gained += tiles[i] * 2
+            i += 2
+        else:
+            merged.append(tiles[i])
+            i += 1
+    return merged + [0] * (len(line) - len(merged)), gained
+
+
+def move(grid, direction):
+    """Apply a move without spawning, returning (new grid, score gained, whether anything moved).
+
+    The input grid is never modified."""
+    count_y, count_x = len(grid), len(grid[0])
+    if direction in (LEFT, RIGHT):
+        lines = [list(row) for row in grid]
+    else:
+        lines = [[grid[y][x] for y in range(count_y)] for x in range(count_x)]
+
+    reverse = direction in (RIGHT, DOWN)
+    gained = 0
+    result = []
+    for line in lines:
+        if reverse:
+            line.reverse()
+        line, score = _merge_line(line)
+        if reverse:
+            line.reverse()
+        gained += score
+        result.append(line)
+
+    if direction in (UP, DOWN):
+        result = [[result[x][y] for x in range(count_x)] for y in range(count_y)]
+    moved = result != [list(row) for row in grid]
+    return result, gained, moved
+
+
+def legal_moves(grid):
+    """Returns the moves that would change the grid."""
+    return [direction for direction in MOVES if move(grid, direction)[2]]
+
+
+def is_lost(grid):
+    """Returns whether no move is possible."""
+    if any(not cell for row in grid for cell in row):
+        return False
+    count_y, count_x = len(grid), len(grid[0])
+    for y in range(count_y):
+        for x in range(count_x):
+            value = grid[y][x]
+            if x + 1 < count_x and grid[y][x + 1] == value:
+                return False
+            if y + 1 < count_y and grid[y + 1][x] == value:
+                return False
+    return True
+
+
+def max_tile(grid):
+    """Returns the largest tile on the grid."""
+    return max(cell for row in grid for cell in row)
+
+
+# log2 of every tile that fits in 4 bits, with 0 for empty cells.
+_EXPONENTS = dict([(0, 0)] + [(1 << i, i) for i in range(1, 16)])
+
+MASK64 = (1 << 64) - 1
+
+
+def encode(grid):
+    """Pack a 4x4 grid into a 64-bit integer, 4 bits of log2 per cell, first cell lowest."""
+    if len(grid) != 4 or any(len(row) != 4 for row in grid):
+        raise ValueError('only 4x4 grids can be encoded')
+    code = shift = 0
+    for row in grid:
+        for cell in row:
+            try:
+                code |= _EXPONENTS[cell] << shift
+            except KeyError:
+                raise ValueError('tile %d can not be encoded' % (cell,))
+            shift += 4
+    return code
+
+
+def decode(code):
+    """Unpack an integer made by encode back into a grid."""
+    cells = [(code >> (4 * i)) & 15 for i in range(16)]
+    return [[1 << cell if cell else 0 for cell in cells[y * 4:y * 4 + 4]] for y in range(4)]
+
+
+def _mirror(code):
+    """Reverse the cells of every row of an encoded grid."""
+    return (((code & 0x000F000F000F000F) << 12) | ((code & 0x00F000F000F000F0) << 4) |
+            ((code & 0x0F000F000F000F00) >> 4) | ((code & 0xF000F000F000F000) >> 12))
+
+
+def _flip(code):
+    """Reverse the order of the rows of an encoded grid."""
+    return (((code & 0xFFFF) << 48) | ((code & 0xFFFF0000) << 16) |
+            ((code >> 16) & 0xFFFF0000) | (code >> 48))
+
+
+def _transpose(code):
+    """Swap the rows and columns of an encoded grid, moving 2x2 blocks of nibbles and then of bytes."""
+    a = ((code & 0xF0F00F0FF0F00F0F) | ((code & 0x0000F0F00000F0F0) << 12) |
+         ((code & 0x0F0F00000F0F0000) >> 12))
+    return ((a & 0xFF00FF0000FF00FF) | ((a & 0x00FF00FF00000000) >> 24) |
+            ((a & 0x00000000FF00FF00) << 24))
+
+
+def symmetries(code):
+    """Returns the encodings of the 8 rotations and reflections of an encoded grid."""
+    result = []
+    for base in (code, _transpose(code)):
+        flipped = _flip(base)
+        result.extend((base, _mirror(base), flipped, _mirror(flipped)))
+    return result
+
+
+def canonical_code(code):
+    """Returns the smallest of the 8 symmetric encodings of an encoded grid."""
+    return min(symmetries(code))
+
+
+def canonical(grid):
+    """Returns the smallest encoding among the 8 rotations and reflections of a 4x4 grid.
+
+    Positions that are the same up to symmetry play the same, so they share a canonical code."""
+    return canonical_code(encode(grid))
+
+
+def mix64(value):
+    """Scramble the bits of a 64-bit integer, with the finalizer of splitmix64."""
+    value = (value ^ (value >> 30)) * 0xbf58476d1ce4e5b9 & MASK64
+    value = (value ^ (value >> 27)) * 0x94d049bb133111eb & MASK64
+    return value ^ (value >> 31)
+
+
+def position_hash(grid):
+    """Returns a 64-bit hash of a grid that is the same for all its symmetries, and stable across runs."""
+    return mix64(canonical(grid))
+
+
+def parse_save(text, count_y=4):
+    """Parse the text of a save file, as written by Game2048.serialize.
+
+    Returns a dictionary of score, grid, won, moves and elapsed."""
+    lines = text.strip().split('\n')
+    return {
+        'score': int(lines[0]),
+        'grid': [list(map(int, row.split())) for row in lines[1:count_y + 1]],
+        'won': int(lines[count_y + 1]) if len(lines) > count_y + 1 else 0,
+        'moves': int(lines[count_y + 2]) if len(lines) > count_y + 2 else 0,
+        'elapsed': float(lines[count_y + 3]) if len(lines) > count_y + 3 else 0,
+    }
@@ -0,0 +1,301 @@
+"""Persistent cache of position evaluations, shared between processes.
+
+Positions are keyed by board.canonical, so the 8 rotations and reflections of
+a board share one entry. Entries live in a fixed size hash table in a memory
+mapped file. Any number of processes can read it at once without locking,
+each entry carrying a checksum so half written entries read as misses.
+Writers take a lock on the file. Each key may sit in one of PROBE slots after
+its hash, and when all are taken, the oldest entry among them is evicted, so
+the file never grows. Hits and misses of every process are added up in the
+header, and boards with tiles too large to encode are never cached."""
+
+import argparse
+import mmap
+import os
+import struct
+from multiprocessing import Pool
+
+from .analytics import iter_positions, iter_records
+from .board import canonical, mix64
+from .lock import FileLock
+from .policy import EVALUATORS
+from .utils import default_data_dir
+
+MAGIC = b'2048EVC2'
+
+# Magic, number of slots, insertion clock, what the values are evaluations of, and hits and misses.
+HEADER = struct.Struct('<8sQQ32sQQ')
+HEADER_SIZE = 128
+CLOCK_OFFSET = 16
+COUNTERS_OFFSET = 56
+COUNTERS = struct.Struct('<QQ')
+
+# Key, value, insertion stamp, and checksum. A stamp of 0 marks an empty slot.
+SLOT = struct.Struct('<QdQQ')
+
+# Number of slots a key may be stored in.
+PROBE = 8
+
+DOUBLE = struct.Struct('<d')
+WORD = struct.Struct('<Q')
+
+
+def _checksum(key, value, stamp):
+    bits = WORD.unpack(DOUBLE.pack(value))[0]
+    return mix64(key ^ mix64(bits ^ mix64(stamp)))
+
+
+class EvaluationCache(object):
+    def __init__(self, name, namespace='', capacity=1 << 20):
+        """Open the cache in a file, creating it with capacity slots if it doesn't exist.
+
+        The namespace names what is cached, such as the evaluator and depth,
+        and must match the one the file was created with."""
+        self.name = name
+        self.namespace = namespace.encode('utf-8')[:32]
+        self.hits = self.misses = self.inserts = self.evictions = 0
+        # Hits and misses already added to the header.
+        self._saved_hits = self._saved_misses = 0
+
+        self.fd = os.open(name, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0))
+        self.lock = FileLock(self.fd)
+        with self.lock:
+            if os.fstat(self.fd).st_size == 0:
+                # Slots must be a power of two, so they can be found by masking the hash.
+                self.capacity = 1 << max(capacity - 1, PROBE).bit_length()
+                os.ftruncate(self.fd, HEADER_SIZE + self.capacity * SLOT.size)
+                os.write(self.fd, HEADER.pack(MAGIC, self.capacity, 1, self.namespace, 0, 0))
+                # On Windows, locks cover the region from the file position, so unlock where it was locked.
+                os.lseek(self.fd, 0, os.SEEK_SET)
+
+        self.map = mmap.mmap(self.fd, 0)
+        magic, self.capacity, _, namespace, _, _ = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('%s is not an evaluation cache' % (name,))
+        if namespace.rstrip(b'\0') != self.namespace:
+            self.close()
+            raise ValueError('%s caches %s, not %s' % (name, namespace.rstrip(b'\0').decode('utf-8'),
+                                                       self.namespace.decode('utf-8')))
+        self.mask = self.capacity - 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if getattr(self, 'map', None) is not None:
+            if HEADER.unpack_from(self.map, 0)[0] == MAGIC:
+                self.save_counters()
+            self.map.close()
+            self.map = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _slots(self, key):
+        start = mix64(key)
+        return [HEADER_SIZE + ((start + i) & self.mask) * SLOT.size for i in range(PROBE)]
+
+    def lookup(self, key, default=None):
+        """Returns the value stored for a canonical code, or default."""
+        for offset in self._slots(key):
+            stored, value, stamp, check = SLOT.unpack_from(self.map, offset)
+            if not stamp:
+                # Keys go in the first free slot, and are never removed, so it can't be further on.
+                break
+            if stored == key and check == _checksum(stored, value, stamp):
+                self.hits += 1
+                return value
+        self.misses += 1
+        return default
+
+    def store_many(self, items):
+        """Store (canonical code, value) pairs, taking the write lock once."""
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        with self.lock:
+            clock = WORD.unpack_from(self.map, CLOCK_OFFSET)[0]
+            for key, value in items:
+                victim = victim_stamp = None
+                for offset in self._slots(key):
+                    stored, _, stamp, check = SLOT.unpack_from(self.map, offset)
+                    if not stamp or stored == key:
+                        victim = offset
+                        break
+                    if victim is None or stamp < victim_stamp:
+                        victim, victim_stamp = offset, stamp
+                else:
+                    self.evictions += 1
+                SLOT.pack_into(self.map, victim, key, value, clock, _checksum(key, value, clock))
+                clock += 1
+                self.inserts += 1
+            WORD.pack_into(self.map, CLOCK_OFFSET, clock)
+
+    def store(self, key, value):
+        self.store_many([(key, value)])
+
+    def get(self, grid, default=None):
+        """Returns the cached evaluation of a grid, or default."""
+        try:
+            key = canonical(grid)
+        except ValueError:
+            # Tiles too large to encode, which is a miss.
+            self.misses += 1
+            return default
+        return self.lookup(key, default)
+
+    def put(self, grid, value):
+        try:
+            key = canonical(grid)
+        except ValueError:
+            return
+        self.store(key, value)
+
+    def memoize(self, evaluate):
+        """Wrap an evaluator taking a grid, so it looks in the cache first."""
+        def cached(grid):
+            value = self.get(grid)
+            if value is None:
+                value = evaluate(grid)
+                self.put(grid, value)
+            return value
+        return cached
+
+    def save_counters(self):
+        """Add the hits and misses of this process since the last call to the totals in the file."""
+        hits, misses = self.hits - self._saved_hits, self.misses - self._saved_misses
+        if not hits and not misses:
+            return
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        with self.lock:
+            total_hits, total_misses = COUNTERS.unpack_from(self.map, COUNTERS_OFFSET)
+            COUNTERS.pack_into(self.map, COUNTERS_OFFSET, total_hits + hits, total_misses + misses)
+        self._saved_hits, self._saved_misses = self.hits, self.misses
+
+    def stats(self):
+        """Returns counters for this process and for every process, and how full the table is."""
+        self.save_counters()
+        total_hits, total_misses = COUNTERS.unpack_from(self.map, COUNTERS_OFFSET)
+        used = sum(1 for i in range(self.capacity)
+                   if SLOT.unpack_from(self.map, HEADER_SIZE + i * SLOT.size)[2])
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / float(self.hits + self.misses or 1),
+            'total_hits': total_hits,
+            'total_misses': total_misses,
+            'total_hit_rate': total_hits / float(total_hits + total_misses or 1),
+            'inserts': self.inserts,
+            'evictions': self.evictions,
+            'used': used,
+            'capacity': self.capacity,
+        }
+
+
+_worker = None
+
+
+def _start_worker(name, namespace, evaluator, depth):
+    global _worker
+    _worker = EvaluationCache(name, namespace), EVALUATORS[evaluator], depth
+
+
+def _warm(grids):
+    """Evaluate the grids that aren't cached yet, in a worker."""
+    cache, evaluate, depth = _worker
+    hits, misses = cache.hits, cache.misses
+    results = []
+    for grid in grids:
+        key = canonical(grid)
+        if cache.lookup(key) is None:
+            results.append((key, evaluate(grid, depth)))
+    cache.store_many(results)
+    cache.save_counters()
+    return len(grids), len(results), cache.hits - hits, cache.misses - misses
+
+
+def _batches(paths, size):
+    batch = []
+    for path in paths:
+        for record in iter_records(path):
+            for grid in iter_positions(record):
+                if max(max(row) for row in grid) <= 1 << 15:
+                    batch.append(grid)
+                    if len(batch) >= size:
+                        yield batch
+                        batch = []
+    if batch:
+        yield batch
+
+
+def warm(name, paths, evaluator='expectimax', depth=1, jobs=1, capacity=1 << 20, batch=256):
+    """Fill the cache with evaluations of every position in saves and move logs.
+
+    Returns the number of positions seen and newly evaluated, and the cache hits and misses."""
+    namespace = '%s-%d' % (evaluator, depth)
+    # Create the file before the workers race to.
+    EvaluationCache(name, namespace, capacity).close()
+
+    seen = evaluated = hits = misses = 0
+    if jobs == 1:
+        _start_worker(name, namespace, evaluator, depth)
+        results = map(_warm, _batches(paths, batch))
+    else:
+        pool = Pool(jobs, _start_worker, (name, namespace, evaluator, depth))
+        results = pool.imap_unordered(_warm, _batches(paths, batch))
+    try:
+        for count, new, batch_hits, batch_misses in results:
+            seen += count
+            evaluated += new
+            hits += batch_hits
+            misses += batch_misses
+    finally:
+        if jobs != 1:
+            pool.close()
+            pool.join()
+    return seen, evaluated, hits, misses
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the shared cache of position evaluations.')
+    parser.add_argument('--cache', help='cache file, defaults to one in the game data directory')
+    parser.add_argument('--evaluator', choices=sorted(EVALUATORS), default='expectimax', help='what to cache')
+    parser.add_argument('--depth', type=int, default=1, help='search depth of the evaluator')
+    commands = parser.add_subparsers(dest='command')
+    command = commands.add_parser('warm', help='evaluate every position in saves and move logs')
+    command.add_argument('paths', nargs='+', help='save files, move logs, directories or archives')
+    command.add_argument('-j', '--jobs', type=int, default=1, help='number of processes to use')
+    command.add_argument('--capacity', type=int, default=1 << 20, help='slots in a new cache file')
+    commands.add_parser('stats', help='show how full the cache is')
+    args = parser.parse_args()
+
+    name = args.cache or os.path.join(default_data_dir(), '2048.%s-%d.evalcache' % (args.evaluator, args.depth))
+    if args.command == 'warm':
+        try:
+            seen, evaluated, hits, misses = warm(name, args.paths, args.evaluator, args.depth, args.jobs,
+                                                 args.capacity)
+        except ValueError as e:
+            print(e)
+            return
+        print('Saw %d positions, evaluated %d new ones, %.1f%% were cached.' %
+              (seen, evaluated, 100.0 * hits / (hits + misses or 1)))
+    elif not os.path.exists(name):
+        print('No cache at %s.' % (name,))
+    else:
+        try:
+            cache = EvaluationCache(name, '%s-%d' % (args.evaluator, args.depth))
+        except ValueError as e:
+            print(e)
+            return
+        with cache:
+            stats = cache.stats()
+        print('%d of %d slots used (%.1f%%).' % (stats['used'], stats['capacity'],
+                                                 100.0 * stats['used'] / stats['capacity']))
+        print('%d hits and %d misses in all, %.1f%% hit rate.' % (stats['total_hits'], stats['total_misses'],
+                                                                   100.0 * stats['total_hit_rate']))
+
+
+if __name__ == '__main__':
+    main()
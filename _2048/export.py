@@ -0,0 +1,228 @@
+"""Offscreen export of saved games and move logs to PNG frames or animated GIFs.
+
+Games are drawn by Game2048 itself onto a surface in memory, so frames look
+exactly like the game window and reuse its pre-rendered tiles, but nothing
+touches the display. Inputs are read with analytics.iter_records. Writing
+GIFs needs Pillow, which is optional."""
+
+import argparse
+import math
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import pygame
+
+from .analytics import iter_records
+from .board import DOWN, LEFT, RIGHT, UP
+from .game import Game2048
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+KEYS = {LEFT: pygame.K_LEFT, RIGHT: pygame.K_RIGHT, UP: pygame.K_UP, DOWN: pygame.K_DOWN}
+
+# How long animation frames are shown in GIFs, in ms.
+TWEEN_DURATION = 20
+
+# Pillow holds every frame of a GIF in memory, a byte per pixel, so each GIF is
+# limited to this many pixels in all. Longer games are exported without the
+# animation, and if that is still too much, with smaller frames.
+GIF_PIXEL_BUDGET = 256 << 20
+
+
+class ExportManager(object):
+    """Stands in for GameManager, keeping the best score in memory and saving nothing."""
+
+    def __init__(self, score=0):
+        self.score = score
+
+    def got_score(self, score):
+        if score > self.score:
+            delta = score - self.score
+            self.score = score
+            return delta
+        return 0
+
+    def game_over(self, game):
+        pass
+
+    def new_game(self):
+        pass
+
+    def save(self):
+        pass
+
+    def flush(self):
+        pass
+
+
+class OffscreenGame(Game2048):
+    """A game drawn onto a surface in memory, handing each frame to sink(surface, tween)."""
+
+    def __init__(self, sink, size=(Game2048.WIDTH, Game2048.HEIGHT), animate=True, **kwargs):
+        self.sink = sink
+        self.animate_moves = animate
+        self._tweening = False
+        self._next_spawn = None
+        Game2048.__init__(self, ExportManager(kwargs.get('score', 0)), pygame.Surface(size), **kwargs)
+
+    def present(self):
+        self.sink(self.screen, self._tweening)
+
+    def _choose_spawn(self, free):
+        return self._next_spawn
+
+    def animate(self, *args):
+        # Render every frame right away, as fast as possible.
+        if self.animate_moves:
+            Game2048.animate(self, *args)
+            self._tweening = True
+            try:
+                for _ in self._frames:
+                    self.present()
+            finally:
+                self._tweening = False
+                self._frames = None
+
+    def replay(self, moves):
+        """Draw the current position, then play through moves as (direction, x, y, value) of the spawn."""
+        self.on_draw()
+        for direction, x, y, value in moves:
+            self._next_spawn = (x, y, value) if value else None
+            self.key_handlers[KEYS[direction]](None)
+            self.on_draw()
+            # Dismiss the won overlay after showing it once, so the replay can carry on.
+            if self.won == 1:
+                self.won += 1
+
+
+class PNGSink(object):
+    """Writes every frame to a numbered PNG file in a directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.frames = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __call__(self, surface, tween):
+        pygame.image.save(surface, os.path.join(self.directory, 'frame-%05d.png' % (self.frames,)))
+        self.frames += 1
+
+    def close(self):
+        pass
+
+
+class GIFSink(object):
+    """Collects frames as palette images, and writes them as an animated GIF when closed.
+
+    Frames are scaled down by scale, to keep long GIFs within GIF_PIXEL_BUDGET."""
+
+    def __init__(self, name, hold=250, scale=1):
+        if Image is None:
+            raise RuntimeError('Pillow is needed to write GIFs.')
+        self.name = name
+        self.hold = hold
+        self.scale = scale
+        self.images = []
+        self.durations = []
+
+    @property
+    def frames(self):
+        return len(self.images)
+
+    def __call__(self, surface, tween):
+        width, height = surface.get_size()
+        image = Image.frombytes('RGB', (width, height), pygame.image.tostring(surface, 'RGB'))
+        if self.scale < 1:
+            image = image.resize((max(1, int(width * self.scale)), max(1, int(height * self.scale))),
+                                 Image.BILINEAR)
+        self.images.append(image.convert('P', palette=Image.ADAPTIVE))
+        self.durations.append(TWEEN_DURATION if tween else self.hold)
+
+    def close(self):
+        if self.images:
+            self.images[0].save(self.name, save_all=True, append_images=self.images[1:],
+                                duration=self.durations, loop=0)
+        self.images = []
+
+
+def export_record(task):
+    """Render one record to the output directory, returning the number of frames written."""
+    index, (kind, data), options = task
+    if not pygame.font.get_init():
+        pygame.font.init()
+
+    if kind == 'save':
+        def save_frame(surface, tween):
+            pygame.image.save(surface, os.path.join(options['output'], 'save-%05d.png' % (index,)))
+        OffscreenGame(save_frame, options['size'], grid=data['grid'], score=data['score'], won=data['won']).on_draw()
+        return 1
+
+    animate = options['animate']
+    if options['format'] == 'gif':
+        name = os.path.join(options['output'], 'game-%05d.gif' % (index,))
+        width, height = options['size']
+        positions = len(data['moves']) + 1
+        if animate and positions * (1 + Game2048.ANIMATION_FRAMES) * width * height > GIF_PIXEL_BUDGET:
+            sys.stderr.write('%s has too many frames to animate, exporting it without the animation.\n' % (name,))
+            animate = False
+        scale = min(1, math.sqrt(GIF_PIXEL_BUDGET / float(positions * width * height)))
+        sink = GIFSink(name, options['hold'], scale)
+    else:
+        sink = PNGSink(os.path.join(options['output'], 'game-%05d' % (index,)))
+    game = OffscreenGame(sink, options['size'], animate, grid=[list(row) for row in data['grid']])
+    game.replay(data['moves'])
+    frames = sink.frames
+    sink.close()
+    return frames
+
+
+def export(paths, output, format='png', size=(Game2048.WIDTH, Game2048.HEIGHT), animate=False,
+           hold=250, jobs=1):
+    """Export every record under paths, returning (games, frames, seconds taken)."""
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    options = {'output': output, 'format': format, 'size': size, 'animate': animate, 'hold': hold}
+    records = (record for path in paths for record in iter_records(path))
+    tasks = ((index, record, options) for index, record in enumerate(records))
+
+    start = time.time()
+    games = frames = 0
+    pool = Pool(jobs) if jobs != 1 else None
+    try:
+        for count in pool.imap_unordered(export_record, tasks) if pool else map(export_record, tasks):
+            games += 1
+            frames += count
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return games, frames, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render saved games and move logs to PNG frames or GIFs.')
+    parser.add_argument('paths', nargs='+', help='save files, move logs, directories or archives')
+    parser.add_argument('-o', '--output', default='.', help='directory to write to')
+    parser.add_argument('-f', '--format', choices=('png', 'gif'), default='png', help='format for replays')
+    parser.add_argument('-s', '--size', default='%dx%d' % (Game2048.WIDTH, Game2048.HEIGHT),
+                        help='frame size, as WIDTHxHEIGHT')
+    parser.add_argument('--animate', action='store_true',
+                        help='include the tile moving animation, except in GIFs of very long games')
+    parser.add_argument('--hold', type=int, default=250, help='ms to show each position in GIFs')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes to use')
+    args = parser.parse_args()
+
+    size = tuple(map(int, args.size.lower().split('x')))
+    games, frames, elapsed = export(args.paths, args.output, args.format, size, args.animate, args.hold, args.jobs)
+    print('Exported %d games, %d frames in %.2fs, %.1f frames/sec.' %
+          (games, frames, elapsed, frames / elapsed if elapsed else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,10 +5,12 @@ This class handles the actual rendering of a game, and the game logic."""
 import os
 import random
 import sys
+import time
 
 import pygame
 
-from .utils import load_font, center
+from .board import parse_save
+from .utils import LRUCache, load_font, center
 
 if sys.version_info[0] < 3:
     range = xrange
@@ -48,6 +50,21 @@ class Game2048(object):
     # Length of tile moving animation.
     ANIMATION_FRAMES = 10
 
+    # Longest gap between moves, in seconds, counted as playing time.
+    IDLE_LIMIT = 30
+
+    # How long the window size has to stay still before assets are rendered for it, in ms.
+    RESIZE_SETTLE = 150
+
+    # Posted by a timer once a resize has settled.
+    RESIZE_EVENT = pygame.USEREVENT
+
+    # Everything rendered for a particular window size, and how many sizes to keep.
+    ASSETS = ('tiles', '_scale_cache', 'font', 'score_font', 'label_font', 'button_font',
+              'score_label', 'best_label', 'losing_overlay', '_lost_try_again',
+              'won_overlay', '_keep_going', '_won_try_again', 'title', '_new_game')
+    ASSET_CACHE_SIZE = 4
+
     BACKGROUND = (0xbb, 0xad, 0xa0)
     FONT_NAME = os.path.join(os.path.dirname(__file__), 'ClearSans.ttf')
     BOLD_NAME = os.path.join(os.path.dirname(__file__), 'ClearSans-Bold.ttf')
@@ -73,31 +90,35 @@ class Game2048(object):
         (131072, (94, 94, 255), (249, 246, 242)),
     )
 
-    def __init__(self, manager, screen, grid=None, score=0, won=0):
+    # Rendered assets, shared by all games, keyed by class and window size.
+    _asset_cache = LRUCache(ASSET_CACHE_SIZE)
+
+    def __init__(self, manager, screen, grid=None, score=0, won=0, moves=0, elapsed=0):
         """Initializes the game."""
         # Stores the manager, screen, score, state, and winning status.
         self.manager = manager
         self.old_score = self.score = score
-        self.screen = screen
+
+        # The window, and the surface actually drawn on, which is an offscreen
+        # canvas of the old size while a resize is settling.
+        self.display = self.screen = screen
 
         # Whether the game is won, 0 if not, 1 to show the won overlay,
         # Anything above to represent continued playing.
         self.won = won
 
         self.lost = False
-        self.tiles = {}
 
-        # A cache for scaled tiles.
-        self._scale_cache = {}
-
-        # The point on the screen where the game actually takes place.
-        self.origin = (0, 120)
+        # Frames of the move being animated, if any.
+        self._frames = None
 
-        self.game_width = self.WIDTH - self.origin[0]
-        self.game_height = self.HEIGHT - self.origin[1]
+        # Number of moves made, and seconds spent playing, counted from move to move.
+        self.moves = moves
+        self.played = elapsed
+        self._last_move = time.time()
 
-        self.cell_width = (self.game_width - self.BORDER) / self.COUNT_X - self.BORDER
-        self.cell_height = (self.game_height - self.BORDER) / self.COUNT_Y - self.BORDER
+        # Whether this game has been handed to the manager's history.
+        self.recorded = False
 
         # Use saved grid if possible.
         if grid is None:
@@ -151,21 +172,13 @@ class Game2048(object):
             pygame.QUIT: self.on_quit,
             pygame.KEYDOWN: self.on_key_down,
             pygame.MOUSEBUTTONUP: self.on_mouse_up,
+            pygame.VIDEORESIZE: self.on_resize,
+            pygame.VIDEOEXPOSE: self.on_expose,
+            self.RESIZE_EVENT: self.on_resize_settled,
         }
 
-        # Loading fonts and creating labels.
-        self.font = load_font(self.BOLD_NAME, 50)
-        self.score_font = load_font(self.FONT_NAME, 20)
-        self.label_font = load_font(self.FONT_NAME, 18)
-        self.button_font = load_font(self.FONT_NAME, 30)
-        self.score_label = self.label_font.render('SCORE', True, (238, 228, 218))
-        self.best_label = self.label_font.render('BEST', True, (238, 228, 218))
-
-        # Create tiles, overlays, and a header section.
-        self._create_default_tiles()
-        self.losing_overlay, self._lost_try_again = self._make_lost_overlay()
-        self.won_overlay, self._keep_going, self._won_try_again = self._make_won_overlay()
-        self.title, self._new_game = self._make_title()
+        # Lay out the game, and get the tiles, overlays, and header section for the size.
+        self.resize(screen.get_size(), defer=False)
 
     @classmethod
     def icon(cls, size):
@@ -177,14 +190,98 @@ class Game2048(object):
         tile.blit(label, ((size - width) / 2, (size - height) / 2))
         return tile
 
+    def _px(self, length):
+        """Scale a length in the default 480x600 layout to the current size."""
+        return max(1, int(round(length * self.scale)))
+
+    def _layout(self, size):
+        """Compute the geometry of the game for a window size, keeping the aspect ratio."""
+        self.size = width, height = size
+        self.scale = min(width / float(self.WIDTH), height / float(self.HEIGHT))
+        self.width = self.WIDTH * self.scale
+
+        # Center the game in the window.
+        self.left = (width - self.width) / 2
+        self.top = (height - self.HEIGHT * self.scale) / 2
+        self.border = self.BORDER * self.scale
+
+        # The point on the screen where the game actually takes place.
+        self.origin = (self.left, self.top + 120 * self.scale)
+
+        self.game_width = self.width
+        self.game_height = self.HEIGHT * self.scale - 120 * self.scale
+
+        self.cell_width = (self.game_width - self.border) / self.COUNT_X - self.border
+        self.cell_height = (self.game_height - self.border) / self.COUNT_Y - self.border
+
+    def _build_assets(self):
+        """Load fonts and render every label, tile, overlay and the header for the current layout."""
+        self.tiles = {}
+
+        # A cache for scaled tiles.
+        self._scale_cache = {}
+
+        # Loading fonts and creating labels.
+        self.font = load_font(self.BOLD_NAME, self._px(50))
+        self.score_font = load_font(self.FONT_NAME, self._px(20))
+        self.label_font = load_font(self.FONT_NAME, self._px(18))
+        self.button_font = load_font(self.FONT_NAME, self._px(30))
+        self.score_label = self.label_font.render('SCORE', True, (238, 228, 218))
+        self.best_label = self.label_font.render('BEST', True, (238, 228, 218))
+
+        # Create tiles, overlays, and a header section.
+        self._create_default_tiles()
+        self.losing_overlay, self._lost_try_again = self._make_lost_overlay()
+        self.won_overlay, self._keep_going, self._won_try_again = self._make_won_overlay()
+        self.title, self._new_game = self._make_title()
+        return dict((name, getattr(self, name)) for name in self.ASSETS)
+
+    def resize(self, size, defer=True):
+        """Lay out the game for a new window size.
+
+        Assets come from the cache if this size was seen recently. Otherwise, if defer
+        is set, the old assets are stretched until the size settles for RESIZE_SETTLE ms,
+        so that dragging the window edge doesn't rasterize fonts on every event."""
+        key = type(self), tuple(size)
+        assets = self._asset_cache.get(key)
+        if assets is None and defer:
+            pygame.time.set_timer(self.RESIZE_EVENT, self.RESIZE_SETTLE)
+        else:
+            self._layout(key[1])
+            if assets is None:
+                assets = self._asset_cache[key] = self._build_assets()
+            for name, value in assets.items():
+                setattr(self, name, value)
+        self._update_target()
+
+    def _update_target(self):
+        """Draw straight to the window if the assets fit it, otherwise to a canvas of their size."""
+        if self.display.get_size() == self.size:
+            self.screen = self.display
+        elif self.screen is self.display or self.screen.get_size() != self.size:
+            self.screen = pygame.Surface(self.size)
+
+    def present(self):
+        """Show what was drawn, stretching the canvas over the window if a resize is settling."""
+        if self.screen is not self.display:
+            pygame.transform.scale(self.screen, self.display.get_size(), self.display)
+        pygame.display.flip()
+
+    def _to_canvas(self, position):
+        """Map a window coordinate to the surface being drawn on."""
+        if self.screen is self.display:
+            return position
+        (x, y), (w1, h1), (w2, h2) = position, self.display.get_size(), self.size
+        return x * w2 / w1, y * h2 / h1
+
     def _make_tile(self, value, background, text):
         """Renders a tile, according to its value, and background and foreground colours."""
         tile = pygame.Surface((self.cell_width, self.cell_height), pygame.SRCALPHA)
         pygame.draw.rect(tile, background, (0, 0, self.cell_width, self.cell_height))
         # The "zero" tile doesn't have anything inside.
         if value:
-            label = load_font(self.BOLD_NAME, 50 if value < 1000 else
-                              (40 if value < 10000 else 30)).render(str(value), True, text)
+            label = load_font(self.BOLD_NAME, self._px(50 if value < 1000 else
+                                                       (40 if value < 10000 else 30))).render(str(value), True, text)
             width, height = label.get_size()
             tile.blit(label, ((self.cell_width - width) / 2, (self.cell_height - height) / 2))
         return tile
@@ -202,37 +299,38 @@ class Game2048(object):
         # the width and height of the text.
         x, y = location(w, h)
         # Draw a box with some border space.
-        pygame.draw.rect(overlay, (238, 228, 218), (x - 5, y - 5, w + 10, h + 10))
+        pad = self._px(5)
+        pygame.draw.rect(overlay, (238, 228, 218), (x - pad, y - pad, w + 2 * pad, h + 2 * pad))
         overlay.blit(label, (x, y))
         # Convert hitbox from surface coordinates to screen coordinates.
-        x += self.origin[0] - 5
-        y += self.origin[1] - 5
+        x += self.origin[0] - pad
+        y += self.origin[1] - pad
         # Return the hitbox.
-        return x - 5, y - 5, x + w + 10, y + h + 10
+        return x - pad, y - pad, x + w + 2 * pad, y + h + 2 * pad
 
     def _make_lost_overlay(self):
         overlay = pygame.Surface((self.game_width, self.game_height), pygame.SRCALPHA)
         overlay.fill((255, 255, 255, 128))
         label = self.font.render('YOU LOST!', True, (0, 0, 0))
         width, height = label.get_size()
-        overlay.blit(label, (center(self.game_width, width), self.game_height / 2 - height - 10))
+        overlay.blit(label, (center(self.game_width, width), self.game_height / 2 - height - self._px(10)))
         return overlay, self._draw_button(overlay, 'Try Again',
                                           lambda w, h: ((self.game_width - w) / 2,
-                                                        self.game_height / 2 + 10))
+                                                        self.game_height / 2 + self._px(10)))
 
     def _make_won_overlay(self):
         overlay = pygame.Surface((self.game_width, self.game_height), pygame.SRCALPHA)
         overlay.fill((255, 255, 255, 128))
         label = self.font.render('YOU WON!', True, (0, 0, 0))
         width, height = label.get_size()
-        overlay.blit(label, ((self.game_width - width) / 2, self.game_height / 2 - height - 10))
+        overlay.blit(label, ((self.game_width - width) / 2, self.game_height / 2 - height - self._px(10)))
         return (overlay,
                 self._draw_button(overlay, 'Keep Playing',
                                   lambda w, h: (self.game_width / 4 - w / 2,
-                                                self.game_height / 2 + 10)),
+                                                self.game_height / 2 + self._px(10))),
                 self._draw_button(overlay, 'Try Again',
                                   lambda w, h: (3 * self.game_width / 4 - w / 2,
-                                                self.game_height / 2 + 10)))
+                                                self.game_height / 2 + self._px(10))))
 
     def _is_in_keep_going(self, x, y):
         """Checks if the mouse is in the keep going button, and if the won overlay is shown."""
@@ -260,24 +358,27 @@ class Game2048(object):
     def _make_title(self):
         """Draw the header section."""
         # Draw the game title.
-        title = pygame.Surface((self.game_width, self.origin[1]), pygame.SRCALPHA)
+        height = self.origin[1] - self.top
+        title = pygame.Surface((self.game_width, height), pygame.SRCALPHA)
         title.fill((0, 0, 0, 0))
         label = self.font.render(self.NAME, True, (119, 110, 101))
-        title.blit(label, (self.BORDER, (90 - label.get_height()) / 2))
+        title.blit(label, (self.border, (self._px(90) - label.get_height()) / 2))
         # Draw the label for the objective.
-        label = load_font(self.FONT_NAME, 18).render(
+        label = load_font(self.FONT_NAME, self._px(18)).render(
             'Join the numbers and get to the %d tile!' % self.WIN_TILE, True, (119, 110, 101))
-        title.blit(label, (self.BORDER, self.origin[1] - label.get_height() - self.BORDER))
+        title.blit(label, (self.border, height - label.get_height() - self.border))
 
         # Draw the new game button and calculate its hitbox.
-        x1, y1 = self.WIDTH - self.BORDER - 100, self.origin[1] - self.BORDER - 28
-        w, h = 100, 30
+        x1, y1 = self.width - self.border - self._px(100), height - self.border - self._px(28)
+        w, h = self._px(100), self._px(30)
         pygame.draw.rect(title, (238, 228, 218), (x1, y1, w, h))
-        label = load_font(self.FONT_NAME, 18).render('New Game', True, (119, 110, 101))
+        label = load_font(self.FONT_NAME, self._px(18)).render('New Game', True, (119, 110, 101))
         w1, h1 = label.get_size()
         title.blit(label, (x1 + (w - w1) / 2, y1 + (h - h1) / 2))
 
-        # Return the title section and its hitbox.
+        # Return the title section and its hitbox in screen coordinates.
+        x1 += self.left
+        y1 += self.top
         return title, (x1, y1, x1 + w, y1 + h)
 
     def free_cells(self):
@@ -313,8 +414,8 @@ class Game2048(object):
     def get_tile_location(self, x, y):
         """Get the screen coordinate for the top-left corner of a tile."""
         x1, y1 = self.origin
-        x1 += self.BORDER + (self.BORDER + self.cell_width) * x
-        y1 += self.BORDER + (self.BORDER + self.cell_height) * y
+        x1 += self.border + (self.border + self.cell_width) * x
+        y1 += self.border + (self.border + self.cell_height) * y
         return x1, y1
 
     def draw_grid(self):
@@ -331,18 +432,19 @@ class Game2048(object):
         """Draw a score box, whether current or best."""
         pygame.draw.rect(self.screen, (187, 173, 160), (x1, y1, width, height))
         w, h = label.get_size()
-        self.screen.blit(label, (x1 + (width - w) / 2, y1 + 8))
+        self.screen.blit(label, (x1 + (width - w) / 2, y1 + self._px(8)))
         score = self.score_font.render(str(score), True, (255, 255, 255))
         w, h = score.get_size()
         self.screen.blit(score, (x1 + (width - w) / 2, y1 + (height + label.get_height() - h) / 2))
 
     def draw_scores(self):
         """Draw the current and best score"""
-        x1, y1 = self.WIDTH - self.BORDER - 200 - 2 * self.BORDER, self.BORDER
-        width, height = 100, 60
-        self.screen.fill((255, 255, 255), (x1, 0, self.WIDTH - x1, height + y1))
+        x1 = self.left + self.width - self.border - self._px(200) - 2 * self.border
+        y1 = self.top + self.border
+        width, height = self._px(100), self._px(60)
+        self.screen.fill((255, 255, 255), (x1, self.top, self.left + self.width - x1, height + self.border))
         self._draw_score_box(self.score_label, self.score, (x1, y1), (width, height))
-        x2 = x1 + width + self.BORDER
+        x2 = x1 + width + self.border
         self._draw_score_box(self.best_label, self.manager.score, (x2, y1), (width, height))
         return (x1, y1), (x2, y1), width, height
 
@@ -369,8 +471,17 @@ class Game2048(object):
         """Calculate the centre of a tile given the top-left corner and the size of the image."""
         return x + (self.cell_width - w) / 2, y + (self.cell_height - h) / 2
 
+    @property
+    def animating(self):
+        """Whether a move is being animated, and on_draw should be called every frame."""
+        return self._frames is not None
+
     def animate(self, animation, static, score, best, appear):
-        """Handle animation."""
+        """Start animating a move, drawn one frame per call to on_draw."""
+        self._frames = self._animation_frames(animation, static, score, best, appear)
+
+    def _animation_frames(self, animation, static, score, best, appear):
+        """Draw the frames of an animation, yielding after each one."""
 
         # Create a surface of static parts in the animation.
         surface = pygame.Surface((self.game_width, self.game_height), 0)
@@ -384,9 +495,6 @@ class Game2048(object):
                 y1 -= self.origin[1]
                 surface.blit(self.tiles[static.get((x, y), 0)], (x1, y1))
 
-        # Pygame clock for FPS control.
-        clock = pygame.time.Clock()
-
         if score:
             score_label = self.label_font.render('+%d' % score, True, (119, 110, 101))
             w1, h1 = score_label.get_size()
@@ -397,12 +505,6 @@ class Game2048(object):
 
         # Loop through every frame.
         for frame in range(self.ANIMATION_FRAMES):
-            # Limit at 60 fps.
-            clock.tick(60)
-
-            # Pump events.
-            pygame.event.pump()
-
             self.screen.blit(surface, self.origin)
 
             # Calculate animation progress.
@@ -428,7 +530,12 @@ class Game2048(object):
             if best:
                 self.screen.blit(best_label, (x2 + (w - w2) / 2, y2 + (h - h2) / 2 - dt * h))
 
-            pygame.display.flip()
+            yield
+
+    def _choose_spawn(self, free):
+        """Pick the tile to spawn after a move, as (x, y, value), among the free cells."""
+        x, y = random.choice(free)
+        return x, y, random.randint(0, 10) and 2 or 4
 
     def _spawn_new(self, count=1):
         """Spawn some new tiles."""
@@ -483,11 +590,18 @@ class Game2048(object):
         new_tiles = set()
 
         if moved:
+            self.moves += 1
+            # Gaps longer than IDLE_LIMIT were spent away from the game, so only the limit counts.
+            now = time.time()
+            self.played += min(now - self._last_move, self.IDLE_LIMIT)
+            self._last_move = now
+            self.manager.save()
             # Spawn new tiles if there are holes.
-            if free:
-                x, y = random.choice(free)
-                value = self.grid[y][x] = random.randint(0, 10) and 2 or 4
-                new_tiles.add((x, y, value))
+            spawned = free and self._choose_spawn(free)
+            if spawned:
+                x, y, value = spawned
+                self.grid[y][x] = value
+                new_tiles.add(spawned)
             animation = []
             static = {}
             # Check all tiles and potential movement:
@@ -506,42 +620,76 @@ class Game2048(object):
 
         if not self.has_free_cells() and not self.has_free_moves():
             self.lost = True
+            self.manager.game_over(self)
 
     def on_event(self, event):
-        self.handlers.get(event.type, lambda e: None)(event)
+        """Handle an event, returning whether the game may need to be redrawn."""
+        handler = self.handlers.get(event.type)
+        return handler is not None and handler(event) is not False
 
     def on_key_down(self, event):
-        self.key_handlers.get(event.key, lambda e: None)(event)
+        handler = self.key_handlers.get(event.key)
+        return handler is not None and handler(event) is not False
+
+    def on_expose(self, event):
+        # Nothing changed, but the window needs to be redrawn.
+        pass
 
     def on_mouse_up(self, event):
-        if self._is_in_restart(*event.pos) or self._is_in_try_again(*event.pos):
+        position = self._to_canvas(event.pos)
+        if self._is_in_restart(*position) or self._is_in_try_again(*position):
             self.manager.new_game()
-        elif self._is_in_keep_going(*event.pos):
+        elif self._is_in_keep_going(*position):
             self.won += 1
 
+    def on_resize(self, event):
+        # Pygame 2 resizes the window surface by itself, older versions need a new mode set.
+        display = pygame.display.get_surface()
+        if display.get_size() != tuple(event.size):
+            display = pygame.display.set_mode(event.size, pygame.RESIZABLE)
+        self.manager.screen = self.display = display
+        self.resize(display.get_size())
+
+    def on_resize_settled(self, event):
+        pygame.time.set_timer(self.RESIZE_EVENT, 0)
+        self.resize(self.display.get_size(), defer=False)
+
     def on_draw(self):
+        # Draw the next frame of the animation if there is one, otherwise the whole game.
+        if self._frames is not None:
+            try:
+                next(self._frames)
+            except StopIteration:
+                self._frames = None
+            else:
+                self.present()
+                return
+
         self.screen.fill((255, 255, 255))
-        self.screen.blit(self.title, (0, 0))
+        self.screen.blit(self.title, (self.left, self.top))
         self.draw_scores()
         self.draw_grid()
         if self.won == 1:
             self.draw_won_overlay()
         elif self.lost:
             self.draw_lost_overlay()
-        pygame.display.flip()
+        self.present()
 
     def on_quit(self, event):
+        self.manager.flush()
         raise SystemExit()
 
     @classmethod
     def from_save(cls, text, *args, **kwargs):
-        lines = text.strip().split('\n')
-        kwargs['score'] = int(lines[0])
-        kwargs['grid'] = [list(map(int, row.split())) for row in lines[1:5]]
-        kwargs['won'] = int(lines[5]) if len(lines) > 5 else 0
+        kwargs.update(parse_save(text, cls.COUNT_Y))
         return cls(*args, **kwargs)
 
+    @property
+    def duration(self):
+        """Seconds spent playing this game, not counting time left idle."""
+        return self.played
+
     def serialize(self):
         return '\n'.join([str(self.score)] +
                          [' '.join(map(str, row)) for row in self.grid] +
-                         [str(self.won)])
+                         [str(self.won), str(self.moves), '%.3f' % self.duration])
@@ -0,0 +1,136 @@
+"""History of finished games, stored in a local SQLite database.
+
+Records are queued by the GameManager and inserted in batches from its save
+thread. The database runs in WAL mode so several game instances and the
+command line can read and write it at once."""
+
+import argparse
+import datetime
+import os
+import sqlite3
+import time
+
+from .board import max_tile
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    finished REAL NOT NULL,
+    day TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    max_tile INTEGER NOT NULL,
+    moves INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    won INTEGER NOT NULL,
+    lost INTEGER NOT NULL,
+    grid TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_score ON games (score DESC);
+CREATE INDEX IF NOT EXISTS games_day_score ON games (day, score DESC);
+'''
+
+COLUMNS = ('finished', 'day', 'score', 'max_tile', 'moves', 'duration', 'won', 'lost', 'grid')
+
+
+def record_game(game, finished=None):
+    """Snapshot a game as a row for GameHistory.insert."""
+    if finished is None:
+        finished = time.time()
+    return (finished, datetime.date.fromtimestamp(finished).isoformat(),
+            game.score, max_tile(game.grid), game.moves, game.duration,
+            int(bool(game.won)), int(game.lost),
+            '\n'.join(' '.join(map(str, row)) for row in game.grid))
+
+
+class GameHistory(object):
+    def __init__(self, name, timeout=30):
+        # The connection is made here, but written to from the manager's save thread.
+        self.db = sqlite3.connect(name, timeout=timeout, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        # With WAL, this is still safe against corruption, only the last commits may be lost on power failure.
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def insert(self, records):
+        """Insert many rows made by record_game in a single transaction."""
+        with self.db:
+            self.db.executemany('INSERT INTO games (%s) VALUES (%s)' %
+                                (', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))), records)
+
+    def top(self, count=10, day=None):
+        """Returns the highest scoring games, optionally only those finished on a day."""
+        query = 'SELECT finished, score, max_tile, moves, duration FROM games'
+        if day is None:
+            return self.db.execute(query + ' ORDER BY score DESC LIMIT ?', (count,)).fetchall()
+        return self.db.execute(query + ' WHERE day = ? ORDER BY score DESC LIMIT ?', (day, count)).fetchall()
+
+    def daily(self, days=30):
+        """Returns (day, games, best score, average score) for the most recent days played."""
+        return self.db.execute('SELECT day, COUNT(*), MAX(score), AVG(score) FROM games '
+                               'GROUP BY day ORDER BY day DESC LIMIT ?', (days,)).fetchall()
+
+    def stats(self):
+        """Returns (games, best score, average score, total moves, total duration, games won)."""
+        return self.db.execute('SELECT COUNT(*), MAX(score), AVG(score), SUM(moves), '
+                               'SUM(duration), SUM(won) FROM games').fetchone()
+
+    def tiles(self):
+        """Returns how many games reached each max tile, as (tile, games)."""
+        return self.db.execute('SELECT max_tile, COUNT(*) FROM games '
+                               'GROUP BY max_tile ORDER BY max_tile DESC').fetchall()
+
+    def close(self):
+        self.db.close()
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds or 0), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+
+def main():
+    from .utils import default_data_dir
+
+    parser = argparse.ArgumentParser(description='Show leaderboards and statistics of finished games.')
+    parser.add_argument('--db', help='history database, defaults to the one the game uses')
+    commands = parser.add_subparsers(dest='command')
+    top = commands.add_parser('top', help='highest scoring games')
+    top.add_argument('-n', '--count', type=int, default=10, help='number of games to show')
+    top.add_argument('--day', help='only games finished on this day, as YYYY-MM-DD')
+    daily = commands.add_parser('daily', help='games and scores per day')
+    daily.add_argument('-n', '--days', type=int, default=30, help='number of days to show')
+    commands.add_parser('stats', help='overall statistics')
+    commands.add_parser('tiles', help='games reaching each max tile')
+    args = parser.parse_args()
+
+    history = GameHistory(args.db or os.path.join(default_data_dir(), '2048.db'))
+    try:
+        if args.command == 'top':
+            print('%4s  %-19s %8s %7s %6s %9s' % ('#', 'Finished', 'Score', 'Tile', 'Moves', 'Time'))
+            for rank, (finished, score, tile, moves, duration) in enumerate(history.top(args.count, args.day), 1):
+                print('%4d  %-19s %8d %7d %6d %9s' % (
+                    rank, datetime.datetime.fromtimestamp(finished).strftime('%Y-%m-%d %H:%M:%S'),
+                    score, tile, moves, format_duration(duration)))
+        elif args.command == 'daily':
+            print('%-10s %7s %8s %10s' % ('Day', 'Games', 'Best', 'Average'))
+            for day, games, best, average in history.daily(args.days):
+                print('%-10s %7d %8d %10.1f' % (day, games, best, average))
+        elif args.command == 'tiles':
+            for tile, games in history.tiles():
+                print('%7d %7d' % (tile, games))
+        else:
+            games, best, average, moves, duration, won = history.stats()
+            print('Games:    %d' % games)
+            if games:
+                print('Won:      %d' % won)
+                print('Best:     %d' % best)
+                print('Average:  %.1f' % average)
+                print('Moves:    %d' % moves)
+                print('Played:   %s' % format_duration(duration))
+    finally:
+        history.close()
+
+
+if __name__ == '__main__':
+    main()
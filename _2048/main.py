@@ -1,14 +1,18 @@
+import argparse
 import os
 
-import errno
 import pygame
-from appdirs import user_data_dir
 
 from .game import Game2048
 from .manager import GameManager
+from .scheduler import Scheduler
+from .utils import default_data_dir
 
 
-def run_game(game_class=Game2048, title='2048: In Python!', data_dir=None):
+def run_game(game_class=Game2048, title='2048: In Python!', data_dir=None, size=None, fps=60,
+             stats_interval=None):
+    # Ask for real pixels on HiDPI screens, the game lays itself out for any window size.
+    os.environ.setdefault('SDL_WINDOWS_DPI_AWARENESS', 'permonitorv2')
     pygame.init()
     pygame.display.set_caption(title)
 
@@ -21,28 +25,29 @@ def run_game(game_class=Game2048, title='2048: In Python!', data_dir=None):
         os.environ['SDL_VIDEODRIVER'] = 'windib'
 
     if data_dir is None:
-        data_dir = user_data_dir(appauthor='Quantum', appname='2048', roaming=True)
-        try:
-            os.makedirs(data_dir)
-        except OSError as e:
-            if e.errno != errno.EEXIST:
-                raise
-
-    screen = pygame.display.set_mode((game_class.WIDTH, game_class.HEIGHT))
+        data_dir = default_data_dir()
+
+    screen = pygame.display.set_mode(size or (game_class.WIDTH, game_class.HEIGHT), pygame.RESIZABLE)
     manager = GameManager(Game2048, screen,
                           os.path.join(data_dir, '2048.score'),
-                          os.path.join(data_dir, '2048.%d.state'))
+                          os.path.join(data_dir, '2048.%d.state'),
+                          os.path.join(data_dir, '2048.db'))
+    scheduler = Scheduler(fps)
+    if stats_interval:
+        def report():
+            print(scheduler.report())
+        scheduler.call_every(stats_interval, report)
     try:
-        while True:
-            event = pygame.event.wait()
-            manager.dispatch(event)
-            for event in pygame.event.get():
-                manager.dispatch(event)
-            manager.draw()
+        scheduler.run(manager.dispatch, manager.draw, lambda: manager.animating)
     finally:
         pygame.quit()
         manager.close()
 
 
 def main():
-    run_game()
+    parser = argparse.ArgumentParser(description='Play 2048.')
+    parser.add_argument('--fps', type=int, default=60, help='frame rate while animating')
+    parser.add_argument('--stats', type=float, metavar='SECONDS',
+                        help='print the CPU time spent per frame every SECONDS')
+    args = parser.parse_args()
+    run_game(fps=args.fps, stats_interval=args.stats)
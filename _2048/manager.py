@@ -1,14 +1,18 @@
 import os
 import errno
 import itertools
-from threading import Event, Thread
+import sqlite3
+import time
+from threading import Condition, Thread
 
+from .history import GameHistory, record_game
 from .lock import FileLock
-from .utils import write_to_disk
+from .utils import atomic_write, read_file
 
 
 class GameManager(object):
-    def __init__(self, cls, screen, high_score_file, file_name):
+    def __init__(self, cls, screen, high_score_file, file_name, history_file=None,
+                 save_delay=0.5, max_save_delay=5):
         # Stores the initialization status as this might crash.
         self.created = False
 
@@ -16,18 +20,36 @@ class GameManager(object):
         self.screen = screen
         self.save_name = file_name
         self.game_class = cls
+        self.game = None
+
+        # Saves are written once no changes came in for save_delay seconds,
+        # but never later than max_save_delay seconds after the first unsaved change.
+        self.save_delay = save_delay
+        self.max_save_delay = max_save_delay
 
         self._score_changed = False
         self._running = True
 
-        self._change_event = Event()
-        self._saved_event = Event()
+        # Everything below is guarded by this condition, shared with the save thread.
+        self._cond = Condition()
+        # Number of calls to save(), of those taken by the save thread, and of those on disk.
+        self._requested = self._taken = self._written = 0
+        # Calls to save() up to this number are to be written without waiting.
+        self._flush_to = 0
+        self._first_change = self._last_change = 0
+        self.writes = self.failures = 0
+        # Set once the save thread has exited, for whatever reason.
+        self._stopped = False
+
+        # Finished games waiting to be written to the history by the save thread.
+        self.history = GameHistory(history_file) if history_file is not None else None
+        self._finished = []
 
+        # Files are replaced rather than written over, so locks are held on separate lock files.
         try:
-            self.score_fd = self.open_fd(high_score_file)
+            self.score_fd = self.open_fd(high_score_file + '.lock')
         except OSError:
             raise RuntimeError("Can't open high score file.")
-        self.score_file = os.fdopen(self.score_fd, 'r+')
         self.score_lock = FileLock(self.score_fd)
 
         with self.score_lock:
@@ -38,31 +60,30 @@ class GameManager(object):
                 self._score_changed = True
                 self.save()
 
-        # Try opening save files from zero and counting up.
+        # Try locking save files from zero and counting up.
         for i in itertools.count(0):
             name = file_name % (i,)
             try:
-                save = self.open_fd(name)
+                lock = self.open_fd(name + '.lock')
             except IOError:
                 continue
             else:
-                self.save_lock = FileLock(save)
+                self.save_lock = FileLock(lock)
                 try:
                     self.save_lock.acquire(False)
                 except IOError:
                     del self.save_lock
-                    os.close(save)
+                    os.close(lock)
                     continue
 
-                self.save_fd = save
-                self.save_file = os.fdopen(save, 'r+')
+                self.save_fd = lock
+                self.save_path = name
 
-                read = self.save_file.read()
-                if read:
+                read = read_file(name)
+                if read.strip():
                     self.game = self.game_class.from_save(read, self, screen)
                 else:
                     self.new_game()
-                self.save_file.seek(0, os.SEEK_SET)
 
                 print('Running as instance #%d.' % (i,))
                 break
@@ -70,8 +91,6 @@ class GameManager(object):
         self._worker = Thread(target=self._save_daemon)
         self._worker.start()
 
-        self._saved_event.set()
-
         self.created = True
 
     @classmethod
@@ -87,14 +106,25 @@ class GameManager(object):
 
     def new_game(self):
         """Creates a new game of 2048."""
+        if self.game is not None:
+            self._record(self.game)
         self.game = self.game_class(self, self.screen)
         self.save()
 
+    def game_over(self, game):
+        """Called by the game when it is lost."""
+        self._record(game)
+        self.save()
+
+    def _record(self, game):
+        """Queue a game that was played to be recorded in the history, once."""
+        if self.history is not None and game.moves and not game.recorded:
+            game.recorded = True
+            self._finished.append(record_game(game))
+
     def _load_score(self):
         """Load the best score from file."""
-        score = int(self.score_file.read())
-        self.score_file.seek(0, os.SEEK_SET)
-        return score
+        return int(read_file(self.score_name))
 
     def got_score(self, score):
         """Update the best score if the new score is higher, returning the change."""
@@ -110,51 +140,140 @@ class GameManager(object):
     def score(self):
         return self._score
 
+    @property
+    def save_stats(self):
+        """Returns the number of saves requested, writes issued, and saves coalesced into other writes."""
+        with self._cond:
+            return {
+                'requested': self._requested,
+                'writes': self.writes,
+                'coalesced': self._written - self.writes,
+            }
+
     def save(self):
-        self._saved_event.clear()
-        self._change_event.set()
+        """Schedule the game and the best score to be saved."""
+        with self._cond:
+            now = time.time()
+            if self._requested == self._taken:
+                self._first_change = now
+            self._last_change = now
+            self._requested += 1
+            self._cond.notify_all()
+
+    def flush(self):
+        """Write any scheduled save right away, and wait for it to be on disk, or to fail."""
+        with self._cond:
+            target = self._flush_to = self._requested
+            failures = self.failures
+            self._cond.notify_all()
+            while self._written < target and self.failures == failures and not self._stopped:
+                self._cond.wait()
+
+    def _due(self):
+        """Returns when the pending changes should be written."""
+        return min(self._last_change + self.save_delay, self._first_change + self.max_save_delay)
 
     def _save_daemon(self):
-        while self._running:
-            self._change_event.wait()
-            if self._score_changed:
-                with self.score_lock:
-                    try:
-                        score = self._load_score()
-                        self._score = max(score, self._score)
-                    except ValueError:
-                        pass
-                    self.score_file.write(str(self._score))
-                    self.score_file.truncate()
-                    self.score_file.seek(0, os.SEEK_SET)
-                    write_to_disk(self.score_file)
-                    self._score_changed = False
-            if self.game.lost:
-                self.save_file.truncate()
+        with self._cond:
+            try:
+                self._save_loop()
+            finally:
+                # Never leave flush() waiting on a thread that is gone.
+                self._stopped = True
+                self._cond.notify_all()
+
+    def _save_loop(self):
+        """Write saves as they come due, with the condition held except while writing."""
+        while True:
+            while self._running and self._requested == self._taken:
+                self._cond.wait()
+            if self._requested == self._taken:
+                # Closing, and everything is written.
+                break
+
+            # Wait for changes to settle, unless asked to hurry.
+            while self._running and self._flush_to <= self._taken:
+                delay = self._due() - time.time()
+                if delay <= 0:
+                    break
+                self._cond.wait(delay)
+
+            previous, taken = self._taken, self._requested
+            self._taken = taken
+            self._cond.release()
+            try:
+                self._write()
+            except (EnvironmentError, sqlite3.Error) as e:
+                error = e
             else:
-                self.save_file.write(self.game.serialize())
-                self.save_file.truncate()
-                self.save_file.seek(0, os.SEEK_SET)
+                error = None
+            finally:
+                self._cond.acquire()
+
+            if error is None:
+                self.writes += 1
+                self._written = taken
+                self._cond.notify_all()
+                continue
+
+            print('Failed to save: %s' % (error,))
+            self.failures += 1
+            self._cond.notify_all()
+            if not self._running:
+                # Closing, so give up rather than retry forever.
+                break
+            # Keep the changes pending, and try again a little later.
+            self._taken = previous
+            self._cond.wait(max(self.save_delay, 1))
 
-            write_to_disk(self.save_file)
-            self._change_event.clear()
-            self._saved_event.set()
+    def _write(self):
+        if self._score_changed:
+            self._score_changed = False
+            with self.score_lock:
+                try:
+                    score = self._load_score()
+                    self._score = max(score, self._score)
+                except ValueError:
+                    pass
+                try:
+                    atomic_write(self.score_name, str(self._score))
+                except EnvironmentError:
+                    self._score_changed = True
+                    raise
+        if self._finished:
+            # Swap the list out, so anything appended meanwhile lands in this batch or the next.
+            finished, self._finished = self._finished, []
+            try:
+                self.history.insert(finished)
+            except sqlite3.Error as e:
+                # Keep them for the next save, the database may just be busy.
+                print('Failed to record finished games: %s' % (e,))
+                self._finished[:0] = finished
+        atomic_write(self.save_path, '' if self.game.lost else self.game.serialize())
 
     def close(self):
         if self.created:
-            self._running = False
-            self._saved_event.wait()
             self.save()
+            with self._cond:
+                self._running = False
+                self._cond.notify_all()
             self._worker.join()
             self.save_lock.release()
-            self.score_file.close()
-            self.save_file.close()
+            os.close(self.save_fd)
+            os.close(self.score_fd)
+            if self.history is not None:
+                self.history.close()
             self.created = False
 
     __del__ = close
 
     def dispatch(self, event):
-        self.game.on_event(event)
+        """Pass an event to the game, returning whether it needs to be redrawn."""
+        return self.game.on_event(event)
+
+    @property
+    def animating(self):
+        return self.game.animating
 
     def draw(self):
         self.game.on_draw()
@@ -0,0 +1,93 @@
+"""Move policies for bots, and evaluations of positions.
+
+A policy is a callable taking a grid and a random.Random instance,
+and returning one of the moves in board.MOVES, or None if no move is possible.
+Evaluators in EVALUATORS take a grid and a search depth, and return how good
+the position is for the player to move, higher being better."""
+
+from .board import MOVES, free_cells, legal_moves, max_tile, move
+
+# Value of a position with no moves left.
+LOSS = -1e4
+
+# Chances of spawning a 2 and a 4, as in Game2048.
+SPAWNS = ((2, 10 / 11.), (4, 1 / 11.))
+
+
+def random_policy(grid, rng):
+    """Pick uniformly among the moves that change the grid."""
+    moves = legal_moves(grid)
+    return rng.choice(moves) if moves else None
+
+
+def greedy_policy(grid, rng):
+    """Pick the move that gains the most score, breaking ties randomly."""
+    best, choices = -1, []
+    for direction in legal_moves(grid):
+        gained = move(grid, direction)[1]
+        if gained > best:
+            best, choices = gained, [direction]
+        elif gained == best:
+            choices.append(direction)
+    return rng.choice(choices) if choices else None
+
+
+def heuristic(grid):
+    """Prefer empty cells, rows and columns that only go one way, and the largest tile in a corner."""
+    empty = sum(1 for row in grid for cell in row if not cell)
+    disorder = 0
+    for line in [list(row) for row in grid] + [list(column) for column in zip(*grid)]:
+        exponents = [cell.bit_length() for cell in line]
+        pairs = list(zip(exponents, exponents[1:]))
+        disorder += min(sum(max(0, b - a) for a, b in pairs), sum(max(0, a - b) for a, b in pairs))
+    largest = max_tile(grid)
+    corner = largest in (grid[0][0], grid[0][-1], grid[-1][0], grid[-1][-1])
+    return 2.7 * empty - disorder + (largest.bit_length() if corner else 0)
+
+
+def best_move(grid, depth=0, evaluate=heuristic):
+    """Search depth spawns ahead, returning the best (move, expected value), or (None, LOSS)."""
+    best, value = None, LOSS
+    for direction in MOVES:
+        after, gained, moved = move(grid, direction)
+        if moved:
+            expected = gained + _expected(after, depth, evaluate)
+            if best is None or expected > value:
+                best, value = direction, expected
+    return best, value
+
+
+def _expected(grid, depth, evaluate):
+    """Average value over every tile that may spawn on grid."""
+    free = free_cells(grid)
+    if depth <= 0 or not free:
+        return evaluate(grid)
+    total = 0
+    for x, y in free:
+        for value, chance in SPAWNS:
+            grid[y][x] = value
+            total += chance * best_move(grid, depth - 1, evaluate)[1]
+        grid[y][x] = 0
+    return total / len(free)
+
+
+def expectimax(grid, depth=1):
+    """Evaluate a position with the player to move by searching depth spawns ahead."""
+    return best_move(grid, depth)[1]
+
+
+def expectimax_policy(grid, rng):
+    """Pick the move with the best expected value, one spawn ahead."""
+    return best_move(grid, 1)[0]
+
+
+POLICIES = {
+    'random': random_policy,
+    'greedy': greedy_policy,
+    'expectimax': expectimax_policy,
+}
+
+EVALUATORS = {
+    'heuristic': lambda grid, depth: heuristic(grid),
+    'expectimax': expectimax,
+}
@@ -0,0 +1,260 @@
+"""On-disk index of distinct positions, with rotations and reflections folded together.
+
+An index file holds (canonical code, occurrences) entries sorted by code, so
+membership and counts are answered by binary search over a memory map. Indexes
+are built in bulk by sorting chunks of positions into runs, and merging the
+runs, and several indexes merge the same way, so position sets far larger than
+memory can be deduplicated."""
+
+import argparse
+import heapq
+import itertools
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+from multiprocessing import Pool
+
+from .analytics import iter_positions, iter_records, iter_task, make_tasks
+from .board import canonical
+from .utils import replace_file
+
+MAGIC = b'2048IDX1'
+
+# Magic, number of distinct positions, and number of positions seen.
+HEADER = struct.Struct('<8sQQ')
+HEADER_SIZE = 32
+
+# Canonical code and number of times it was seen.
+ENTRY = struct.Struct('<QQ')
+
+# Number of positions sorted in memory at once while building.
+CHUNK = 1 << 20
+
+# Bytes of input handled by a worker at once, so small files share runs.
+BATCH_SIZE = 16 << 20
+
+# Most indexes opened at once while merging, well below the usual limit on open files.
+FAN_IN = 128
+
+
+def write_index(name, entries):
+    """Write (code, count) pairs sorted by code to an index file, adding up equal codes.
+
+    Returns the number of distinct and total positions written."""
+    distinct = total = 0
+    with open(name, 'wb') as f:
+        f.write(b'\0' * HEADER_SIZE)
+        buffer = []
+        for code, group in itertools.groupby(entries, key=lambda entry: entry[0]):
+            count = sum(count for _, count in group)
+            buffer.append(ENTRY.pack(code, count))
+            distinct += 1
+            total += count
+            if len(buffer) >= 4096:
+                f.write(b''.join(buffer))
+                buffer = []
+        f.write(b''.join(buffer))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, distinct, total))
+    return distinct, total
+
+
+class PositionIndex(object):
+    def __init__(self, name):
+        self.name = name
+        with open(name, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.distinct, self.total = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('%s is not a position index' % (name,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def __len__(self):
+        return self.distinct
+
+    def __iter__(self):
+        for i in range(self.distinct):
+            yield ENTRY.unpack_from(self.map, HEADER_SIZE + i * ENTRY.size)
+
+    def count_code(self, code):
+        """Returns how many times a canonical code was seen."""
+        low, high = 0, self.distinct
+        while low < high:
+            middle = (low + high) // 2
+            key, count = ENTRY.unpack_from(self.map, HEADER_SIZE + middle * ENTRY.size)
+            if key < code:
+                low = middle + 1
+            elif key > code:
+                high = middle
+            else:
+                return count
+        return 0
+
+    def count(self, grid):
+        """Returns how many times a grid, or any of its symmetries, was seen."""
+        return self.count_code(canonical(grid))
+
+    def __contains__(self, grid):
+        return self.count(grid) > 0
+
+
+def iter_codes(records):
+    """Yield the canonical code of every position in records, skipping tiles too large to encode."""
+    for record in records:
+        for grid in iter_positions(record):
+            try:
+                yield canonical(grid)
+            except ValueError:
+                pass
+
+
+def _batch_tasks(tasks, size=BATCH_SIZE):
+    """Group units of work made by make_tasks into lists covering about size bytes of input."""
+    batch, total = [], 0
+    for task in tasks:
+        path, start, end = task
+        batch.append(task)
+        total += os.path.getsize(path) if start is None else end - start
+        if total >= size:
+            yield batch
+            batch, total = [], 0
+    if batch:
+        yield batch
+
+
+def _build_runs(args):
+    """Sort the positions of a batch of work into run files of up to chunk positions, returning their names."""
+    batch, directory, chunk = args
+    runs = []
+    codes = iter_codes(itertools.chain.from_iterable(iter_task(task) for task in batch))
+    while True:
+        batch = sorted(itertools.islice(codes, chunk))
+        if not batch:
+            return runs
+        fd, run = tempfile.mkstemp('.run', dir=directory)
+        os.close(fd)
+        write_index(run, ((code, 1) for code in batch))
+        runs.append(run)
+
+
+def _merge(name, sources):
+    # Write to a temporary file, so the output may also be one of the inputs.
+    temp = name + '.tmp'
+    indexes = []
+    try:
+        for source in sources:
+            indexes.append(PositionIndex(source))
+        result = write_index(temp, heapq.merge(*indexes))
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    finally:
+        # Mapped files can't be replaced on Windows, so close the inputs first.
+        for index in indexes:
+            index.close()
+    replace_file(temp, name)
+    return result
+
+
+def merge_indexes(name, sources, fan_in=FAN_IN):
+    """Merge index files into one, returning the number of distinct and total positions.
+
+    At most fan_in files are opened at once. Beyond that, they are merged in
+    several passes through temporary files next to name."""
+    sources = list(sources)
+    directory = None
+    try:
+        while len(sources) > fan_in:
+            if directory is None:
+                directory = tempfile.mkdtemp('.merge', dir=os.path.dirname(os.path.abspath(name)))
+            merged = []
+            for i in range(0, len(sources), fan_in):
+                fd, run = tempfile.mkstemp('.run', dir=directory)
+                os.close(fd)
+                _merge(run, sources[i:i + fan_in])
+                merged.append(run)
+            # Drop the files of the previous pass as soon as they are merged, but never the inputs.
+            for source in sources:
+                if os.path.dirname(source) == directory:
+                    os.remove(source)
+            sources = merged
+        return _merge(name, sources)
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory)
+
+
+def build_index(name, paths, jobs=1, chunk=CHUNK):
+    """Index every position in saves and move logs, returning the number of distinct and total positions."""
+    directory = tempfile.mkdtemp('.runs', dir=os.path.dirname(os.path.abspath(name)))
+    try:
+        tasks = ((batch, directory, chunk) for batch in _batch_tasks(make_tasks(paths)))
+        pool = Pool(jobs) if jobs != 1 else None
+        try:
+            runs = list(itertools.chain.from_iterable(
+                pool.imap_unordered(_build_runs, tasks) if pool else map(_build_runs, tasks)))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        return merge_indexes(name, runs)
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build and query indexes of distinct positions.')
+    commands = parser.add_subparsers(dest='command')
+    command = commands.add_parser('build', help='index every position in saves and move logs')
+    command.add_argument('index', help='index file to write')
+    command.add_argument('paths', nargs='+', help='save files, move logs, directories or archives')
+    command.add_argument('-j', '--jobs', type=int, default=1, help='number of processes to use')
+    command.add_argument('--chunk', type=int, default=CHUNK, help='positions to sort in memory at once')
+    command = commands.add_parser('merge', help='merge indexes into one')
+    command.add_argument('index', help='index file to write')
+    command.add_argument('sources', nargs='+', help='index files to merge')
+    command = commands.add_parser('stats', help='count the positions in an index')
+    command.add_argument('index', help='index file to read')
+    command = commands.add_parser('query', help='look up the positions in saves and move logs')
+    command.add_argument('index', help='index file to read')
+    command.add_argument('paths', nargs='+', help='save files, move logs, directories or archives')
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.command == 'build':
+        distinct, total = build_index(args.index, args.paths, args.jobs, args.chunk)
+    elif args.command == 'merge':
+        distinct, total = merge_indexes(args.index, args.sources)
+    elif args.command == 'stats':
+        with PositionIndex(args.index) as index:
+            distinct, total = index.distinct, index.total
+    else:
+        found = seen = 0
+        with PositionIndex(args.index) as index:
+            for path in args.paths:
+                for code in iter_codes(iter_records(path)):
+                    seen += 1
+                    found += index.count_code(code) > 0
+        print('%d of %d positions are in the index.' % (found, seen))
+        return
+    print('%d distinct of %d positions (%.1f%% duplicates), in %.2fs.' %
+          (distinct, total, 100.0 * (total - distinct) / (total or 1), time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Event loop for the game window, waking up only when there is something to do.
+
+While anything is animating, frames are drawn at a fixed rate. Otherwise, the
+loop sleeps until the next event or timer, and draws only after something
+reported a change. Timers run callbacks once or periodically, on the main
+thread, and a callback returning a true value asks for a redraw."""
+
+import heapq
+import itertools
+import time
+
+import pygame
+
+# CPU time of this process, for measuring how much of a frame was spent working.
+cpu_time = getattr(time, 'process_time', None) or time.clock
+
+
+class Timer(object):
+    def __init__(self, due, interval, callback):
+        self.due = due
+        self.interval = interval
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler(object):
+    def __init__(self, fps=60):
+        self.frame_time = 1.0 / fps
+        self.dirty = True
+        self._timers = []
+        self._counter = itertools.count()
+        self._next_frame = 0
+
+        # Frames drawn, and the CPU time spent on them, since the last report.
+        self.frames = 0
+        self.cpu_total = self.cpu_max = 0
+
+    def call_later(self, delay, callback):
+        """Run callback once, after delay seconds."""
+        return self._add(Timer(time.time() + delay, None, callback))
+
+    def call_every(self, interval, callback):
+        """Run callback every interval seconds, until the timer is cancelled."""
+        return self._add(Timer(time.time() + interval, interval, callback))
+
+    def _add(self, timer):
+        heapq.heappush(self._timers, (timer.due, next(self._counter), timer))
+        return timer
+
+    def invalidate(self):
+        """Ask for the next frame to be drawn."""
+        self.dirty = True
+
+    def _run_timers(self, now):
+        while self._timers and self._timers[0][0] <= now:
+            timer = heapq.heappop(self._timers)[2]
+            if timer.cancelled:
+                continue
+            if timer.interval is not None:
+                # Skip runs that were missed rather than running them all at once.
+                timer.due = max(timer.due + timer.interval, now)
+                self._add(timer)
+            if timer.callback():
+                self.dirty = True
+
+    def _timeout(self, now, animating):
+        """Returns how long to sleep for, or None to sleep until the next event."""
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+        due = []
+        if self._timers:
+            due.append(self._timers[0][0])
+        if self.dirty or animating:
+            due.append(self._next_frame)
+        return max(min(due) - now, 0) if due else None
+
+    def run(self, dispatch, draw, animating=lambda: False):
+        """Run forever, passing events to dispatch, which returns whether to redraw, and drawing with draw.
+
+        animating returns whether frames should be drawn at the full rate even with nothing changed."""
+        while True:
+            timeout = self._timeout(time.time(), animating())
+            if timeout is None:
+                events = [pygame.event.wait()]
+            elif timeout > 0:
+                events = [pygame.event.wait(max(int(timeout * 1000), 1))]
+            else:
+                events = []
+            events += pygame.event.get()
+
+            for event in events:
+                if event.type != pygame.NOEVENT and dispatch(event):
+                    self.dirty = True
+
+            now = time.time()
+            self._run_timers(now)
+            if (self.dirty or animating()) and now >= self._next_frame:
+                self.dirty = False
+                start = cpu_time()
+                draw()
+                self._count_frame(cpu_time() - start)
+
+                # Keep to a steady rate, but don't rush to catch up after falling behind.
+                self._next_frame += self.frame_time
+                if self._next_frame < now:
+                    self._next_frame = now + self.frame_time
+
+    def _count_frame(self, cpu):
+        self.frames += 1
+        self.cpu_total += cpu
+        self.cpu_max = max(self.cpu_max, cpu)
+
+    def report(self):
+        """Returns a summary of the frames drawn since the last report, and starts counting anew."""
+        if self.frames:
+            text = '%d frames, %.2fms CPU per frame on average, %.2fms at most.' % (
+                self.frames, 1000 * self.cpu_total / self.frames, 1000 * self.cpu_max)
+        else:
+            text = 'No frames drawn.'
+        self.frames = 0
+        self.cpu_total = self.cpu_max = 0
+        return text
@@ -0,0 +1,283 @@
+"""Generate datasets of (board, move, outcome) samples by having bots play themselves.
+
+Games are played with the pure logic in board, by a policy from policy.POLICIES,
+across a pool of processes. Every shard is written by exactly one worker, into
+its own memory mapped file, so workers never wait on each other. Each sample
+holds the position encoded with board.encode, the move played from it, and
+the final score and largest tile of its game.
+
+Game number g of shard i is played with the seed '<seed>-<i>-<g>', so a
+dataset is reproducible, and a shard interrupted midway resumes, or grows
+to more games, exactly where it stopped. Shard headers only count whole
+games, and the manifest lists every shard with its counts, so datasets merge
+by listing shards rather than copying them."""
+
+import argparse
+import json
+import mmap
+import os
+import random
+import struct
+import time
+from multiprocessing import Pool
+
+from .board import encode, max_tile, move, new_grid, spawn
+from .policy import POLICIES
+from .utils import atomic_write, read_file
+
+MAGIC = b'2048SPS1'
+
+# Magic, number of games, and number of samples.
+HEADER = struct.Struct('<8sQQ')
+HEADER_SIZE = 32
+
+# Encoded position, final score, move played, and log2 of the final largest tile.
+SAMPLE_FORMAT = '<QIBB'
+SAMPLE = struct.Struct(SAMPLE_FORMAT)
+
+MANIFEST = 'manifest.json'
+
+# Samples to make room for at once, when a shard runs out of space.
+GROW = 1 << 16
+
+
+def play(policy, rng):
+    """Play a game to the end, returning the (encoded grid, move) pairs, final score and largest tile."""
+    grid = new_grid(rng=rng)
+    score = 0
+    history = []
+    while True:
+        direction = policy(grid, rng)
+        if direction is None:
+            break
+        after, gained, moved = move(grid, direction)
+        if not moved:
+            break
+        history.append((encode(grid), direction))
+        grid = after
+        score += gained
+        spawn(grid, 1, rng)
+    return history, score, max_tile(grid)
+
+
+class ShardWriter(object):
+    """Appends whole games to a shard, creating it or continuing where it left off."""
+
+    def __init__(self, name):
+        self.name = name
+        self.fd = os.open(name, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o666)
+        if os.fstat(self.fd).st_size < HEADER_SIZE:
+            os.ftruncate(self.fd, HEADER_SIZE)
+            os.write(self.fd, HEADER.pack(MAGIC, 0, 0))
+        self.map = mmap.mmap(self.fd, 0)
+        magic, self.games, self.samples = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('%s is not a self-play shard' % (name,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _reserve(self, count):
+        needed = HEADER_SIZE + (self.samples + count) * SAMPLE.size
+        if needed > len(self.map):
+            # Grow the file in large steps, since every resize remaps it.
+            self.map.close()
+            os.ftruncate(self.fd, max(needed, HEADER_SIZE + (self.samples + GROW) * SAMPLE.size))
+            self.map = mmap.mmap(self.fd, 0)
+
+    def add_game(self, history, score, largest):
+        """Write the samples of a finished game, and only then count it in the header."""
+        self._reserve(len(history))
+        offset = HEADER_SIZE + self.samples * SAMPLE.size
+        exponent = largest.bit_length() - 1
+        for code, direction in history:
+            SAMPLE.pack_into(self.map, offset, code, score, direction, exponent)
+            offset += SAMPLE.size
+        self.games += 1
+        self.samples += len(history)
+        HEADER.pack_into(self.map, 0, MAGIC, self.games, self.samples)
+
+    def close(self):
+        if getattr(self, 'map', None) is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+            # Drop the room reserved past the last sample.
+            os.ftruncate(self.fd, HEADER_SIZE + self.samples * SAMPLE.size)
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class Shard(object):
+    """Reads the samples in a shard as (encoded grid, move, final score, final largest tile)."""
+
+    def __init__(self, name):
+        self.name = name
+        with open(name, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.games, self.samples = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('%s is not a self-play shard' % (name,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def __len__(self):
+        return self.samples
+
+    def __iter__(self):
+        for i in range(self.samples):
+            code, score, direction, exponent = SAMPLE.unpack_from(self.map, HEADER_SIZE + i * SAMPLE.size)
+            yield code, direction, score, 1 << exponent
+
+
+def load_manifest(directory):
+    """Returns the manifest of the dataset in directory, or None if there is none."""
+    text = read_file(os.path.join(directory, MANIFEST))
+    if not text:
+        return None
+    manifest = json.loads(text)
+    if manifest.get('sample') != SAMPLE_FORMAT:
+        raise ValueError('%s holds samples in a different format' % (directory,))
+    return manifest
+
+
+def save_manifest(directory, shards):
+    atomic_write(os.path.join(directory, MANIFEST), json.dumps({
+        'sample': SAMPLE_FORMAT,
+        'games': sum(shard['games'] for shard in shards),
+        'samples': sum(shard['samples'] for shard in shards),
+        'shards': shards,
+    }, indent=2, sort_keys=True))
+
+
+def generate_shard(task):
+    """Play games into one shard until it holds target games, in a worker."""
+    name, policy, seed, index, target = task
+    start = time.time()
+    choose = POLICIES[policy]
+    with ShardWriter(name) as shard:
+        while shard.games < target:
+            rng = random.Random('%s-%d-%d' % (seed, index, shard.games))
+            shard.add_game(*play(choose, rng))
+        return index, shard.games, shard.samples, time.time() - start
+
+
+def generate(directory, games, policy='random', seed=0, shards=None, jobs=1):
+    """Generate a dataset of games split across shards, resuming any shards already in directory.
+
+    Returns the number of games and samples in the dataset."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    manifest = load_manifest(directory)
+    if manifest is not None:
+        entries = manifest['shards']
+        for entry in entries:
+            if entry['policy'] != policy or entry['seed'] != str(seed) or 'index' not in entry:
+                raise ValueError('%s was not generated by %s with seed %s' % (directory, policy, seed))
+        if shards is not None and shards != len(entries):
+            raise ValueError('%s has %d shards, not %d' % (directory, len(entries), shards))
+    else:
+        entries = [{'name': 'shard-%05d.bin' % (i,), 'policy': policy, 'seed': str(seed), 'index': i,
+                    'games': 0, 'samples': 0} for i in range(shards or jobs)]
+        save_manifest(directory, entries)
+
+    count = len(entries)
+    tasks = [(os.path.join(directory, entry['name']), policy, str(seed), entry['index'],
+              games // count + (i < games % count)) for i, entry in enumerate(entries)]
+
+    pool = Pool(jobs) if jobs != 1 else None
+    try:
+        for index, played, samples, elapsed in (pool.imap_unordered(generate_shard, tasks) if pool else
+                                                map(generate_shard, tasks)):
+            entry = next(entry for entry in entries if entry['index'] == index)
+            entry['games'], entry['samples'] = played, samples
+            save_manifest(directory, entries)
+            print('Shard %d: %d games, %d samples, done in %.2fs.' % (index, played, samples, elapsed))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return sum(entry['games'] for entry in entries), sum(entry['samples'] for entry in entries)
+
+
+def merge(directory, sources):
+    """Write a manifest listing the shards of several datasets, without copying them.
+
+    Returns the number of games and samples in the merged dataset."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    entries = []
+    for source in sources:
+        manifest = load_manifest(source)
+        if manifest is None:
+            raise ValueError('%s has no manifest' % (source,))
+        for entry in manifest['shards']:
+            entry = dict(entry, name=os.path.relpath(os.path.join(source, entry['name']), directory))
+            # Merged shards can't be resumed as one run, as they may come from different ones.
+            entry.pop('index', None)
+            entries.append(entry)
+    save_manifest(directory, entries)
+    return sum(entry['games'] for entry in entries), sum(entry['samples'] for entry in entries)
+
+
+def iter_samples(directory):
+    """Yield every sample of a dataset as (encoded grid, move, final score, final largest tile)."""
+    manifest = load_manifest(directory)
+    if manifest is None:
+        raise ValueError('%s has no manifest' % (directory,))
+    for entry in manifest['shards']:
+        with Shard(os.path.join(directory, entry['name'])) as shard:
+            for sample in shard:
+                yield sample
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate datasets of positions and moves from bot games.')
+    commands = parser.add_subparsers(dest='command')
+    command = commands.add_parser('generate', help='play games into a dataset, resuming it if it exists')
+    command.add_argument('directory', help='dataset directory')
+    command.add_argument('-n', '--games', type=int, required=True, help='number of games the dataset should hold')
+    command.add_argument('-p', '--policy', choices=sorted(POLICIES), default='random', help='how the bots play')
+    command.add_argument('--seed', type=int, default=0, help='seed the games are derived from')
+    command.add_argument('--shards', type=int, help='number of shards, defaults to the number of processes')
+    command.add_argument('-j', '--jobs', type=int, default=1, help='number of processes to use')
+    command = commands.add_parser('merge', help='combine datasets by listing their shards in a new manifest')
+    command.add_argument('directory', help='dataset directory to write the manifest to')
+    command.add_argument('sources', nargs='+', help='dataset directories to merge')
+    command = commands.add_parser('stats', help='count the games and samples in a dataset')
+    command.add_argument('directory', help='dataset directory')
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.command == 'generate':
+        games, samples = generate(args.directory, args.games, args.policy, args.seed, args.shards, args.jobs)
+    elif args.command == 'merge':
+        games, samples = merge(args.directory, args.sources)
+    else:
+        manifest = load_manifest(args.directory)
+        if manifest is None:
+            print('No dataset in %s.' % (args.directory,))
+            return
+        games, samples = manifest['games'], manifest['samples']
+    elapsed = time.time() - start
+    print('%d games, %d samples (%d bytes), in %.2fs.' % (games, samples, samples * SAMPLE.size, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+"""Spectator view, showing many bot games at once in a single window.
+
+Games are played by BotWorker processes, so slow policies never hold up the
+window. Each worker plays some of the boards, and publishes every board as its
+64-bit board.encode code in an array shared with the window. The view compares
+each code against what it last drew, and only blits the changed cells, all in
+one batch, from a single tile atlas shared by every board."""
+
+import argparse
+import heapq
+import math
+import multiprocessing
+import random
+import time
+
+import pygame
+
+from .board import encode, move, new_grid, spawn
+from .game import Game2048
+from .policy import POLICIES
+from .utils import load_font, center
+
+# Width of a cell in the full size game, used to scale the fonts.
+REFERENCE_CELL = (Game2048.WIDTH - Game2048.BORDER) / Game2048.COUNT_X - Game2048.BORDER
+
+
+def publish_code(grid):
+    """Encode a grid to be shown, with tiles too large to encode shown as the largest that can be."""
+    return encode([[min(cell, 1 << 15) for cell in row] for row in grid])
+
+
+class TileAtlas(object):
+    """Every tile of one size, rendered side by side onto a single surface."""
+
+    def __init__(self, size, tiles=Game2048.DEFAULT_TILES, font_name=Game2048.BOLD_NAME):
+        self.size = size
+        self.surface = pygame.Surface((size * len(tiles), size))
+        self.areas = {}
+
+        scale = size / float(REFERENCE_CELL)
+        for i, (value, background, text) in enumerate(tiles):
+            area = pygame.Rect(i * size, 0, size, size)
+            self.surface.fill(background, area)
+            font_size = int((50 if value < 1000 else (40 if value < 10000 else 30)) * scale)
+            # The "zero" tile doesn't have anything inside, and tiny labels are unreadable.
+            if value and font_size >= 6:
+                label = load_font(font_name, font_size).render(str(value), True, text)
+                width, height = label.get_size()
+                # Blit through a subsurface so wide labels can't bleed into the next tile.
+                self.surface.subsurface(area).blit(label, (center(size, width), center(size, height)))
+            self.areas[value] = area
+        self._largest = tiles[-1][0]
+
+        if pygame.display.get_surface() is not None:
+            self.surface = self.surface.convert()
+
+    def area(self, value):
+        """Returns the area of the atlas containing the tile for value."""
+        try:
+            return self.areas[value]
+        except KeyError:
+            return self.areas[self._largest]
+
+
+class BotWorker(multiprocessing.Process):
+    """Plays one game after another on some of the boards, with a move policy from POLICIES.
+
+    The code of board i is written to codes[i]. Aligned 64-bit stores are
+    atomic, so the window never sees a half-written board and needs no lock."""
+
+    def __init__(self, codes, boards, policy='random', seed=None, delay=0.05, restart_delay=1):
+        multiprocessing.Process.__init__(self)
+        self.daemon = True
+        self.codes = codes
+        self.boards = boards
+        self.policy = policy
+        self.seed = seed
+        self.delay = delay
+        self.restart_delay = restart_delay
+
+        self._halt = multiprocessing.Event()
+
+    def run(self):
+        policy = POLICIES[self.policy]
+
+        # When each board is due to move next, as (time, index, grid, rng).
+        # A grid of None means the game was lost, and a new one is due to start.
+        queue = []
+        for index in self.boards:
+            rng = random.Random(None if self.seed is None else self.seed + index)
+            queue.append((0, index, None, rng))
+        heapq.heapify(queue)
+
+        while queue:
+            due, index, grid, rng = heapq.heappop(queue)
+            if self._halt.wait(max(due - time.time(), 0)):
+                break
+
+            if grid is None:
+                grid = new_grid(rng=rng)
+            else:
+                direction = policy(grid, rng)
+                if direction is None:
+                    # Lost, leave the final board up for a bit and start over.
+                    heapq.heappush(queue, (time.time() + self.restart_delay, index, None, rng))
+                    continue
+                grid = move(grid, direction)[0]
+                spawn(grid, 1, rng)
+
+            self.codes[index] = publish_code(grid)
+            heapq.heappush(queue, (time.time() + self.delay, index, grid, rng))
+
+    def stop(self):
+        self._halt.set()
+
+
+class SpectatorView(object):
+    """Draws many 4x4 boards, given as codes from board.encode, scaled down, in a grid on one screen."""
+
+    BACKGROUND = (255, 255, 255)
+    COUNT = 4
+
+    def __init__(self, screen, codes, columns=None):
+        self.screen = screen
+        self.codes = codes
+        self.columns = columns or int(math.ceil(math.sqrt(len(codes))))
+        self.rows = int(math.ceil(len(codes) / float(self.columns)))
+        self.layout()
+
+    def layout(self):
+        """Compute the geometry of each board from the screen size, and render the atlas."""
+        width, height = self.screen.get_size()
+        board = min(width // self.columns, height // self.rows)
+        count = self.COUNT
+
+        # Gap between boards, and border between tiles, in the same proportion as the game.
+        self.gap = max(1, board // 40)
+        inner = board - self.gap * 2
+        self.border = max(1, inner * Game2048.BORDER // (Game2048.WIDTH - Game2048.BORDER))
+        self.cell = max(1, (inner - self.border) // count - self.border)
+        self.board_size = self.border + (self.cell + self.border) * count
+
+        self.origins = [(column * board + self.gap, row * board + self.gap)
+                        for row in range(self.rows)
+                        for column in range(self.columns)][:len(self.codes)]
+        self.atlas = TileAtlas(self.cell)
+        # Atlas areas by the 4-bit exponents in codes.
+        self.areas = [self.atlas.area(1 << exponent if exponent else 0) for exponent in range(16)]
+        self.invalidate()
+
+    def invalidate(self):
+        """Forget what was drawn, so the next draw repaints everything."""
+        self._shown = [None] * len(self.codes)
+        self._full = True
+
+    def get_tile_location(self, index, x, y):
+        """Get the screen coordinate for the top-left corner of a tile on a board."""
+        x1, y1 = self.origins[index]
+        return (x1 + self.border + (self.border + self.cell) * x,
+                y1 + self.border + (self.border + self.cell) * y)
+
+    def draw(self):
+        """Blit the changed cells of every board, returning the dirty rectangles."""
+        dirty = []
+        if self._full:
+            self.screen.fill(self.BACKGROUND)
+            dirty.append(self.screen.get_rect())
+            self._full = False
+
+        atlas = self.atlas.surface
+        blits = []
+        # Copy the shared codes out at once, rather than reading them one by one.
+        for index, code in enumerate(self.codes[:]):
+            shown = self._shown[index]
+            if code == shown:
+                continue
+
+            if shown is None:
+                x1, y1 = self.origins[index]
+                rect = pygame.Rect(x1, y1, self.board_size, self.board_size)
+                self.screen.fill(Game2048.BACKGROUND, rect)
+                dirty.append(rect)
+                # Draw every cell.
+                changed_bits = (1 << 64) - 1
+            else:
+                changed_bits = code ^ shown
+
+            changed = []
+            for cell in range(self.COUNT * self.COUNT):
+                if (changed_bits >> (4 * cell)) & 15:
+                    location = self.get_tile_location(index, cell % self.COUNT, cell // self.COUNT)
+                    blits.append((atlas, location, self.areas[(code >> (4 * cell)) & 15]))
+                    changed.append(pygame.Rect(location, (self.cell, self.cell)))
+            if changed and shown is not None:
+                dirty.append(changed[0].unionall(changed[1:]))
+            self._shown[index] = code
+
+        if blits:
+            self.screen.blits(blits, doreturn=False)
+        return dirty
+
+
+def run_spectator(count=16, size=960, fps=60, delay=0.05, policy='random', seed=None, jobs=None,
+                  title='2048: Spectator'):
+    pygame.init()
+    pygame.display.set_caption(title)
+
+    # Boards are dealt out to the workers in turn, leaving a core for the window by default.
+    jobs = max(1, min(count, jobs or multiprocessing.cpu_count() - 1))
+    codes = multiprocessing.RawArray('Q', count)
+    workers = [BotWorker(codes, list(range(i, count, jobs)), policy, seed, delay) for i in range(jobs)]
+    columns = int(math.ceil(math.sqrt(count)))
+    rows = int(math.ceil(count / float(columns)))
+    screen = pygame.display.set_mode((size, size * rows // columns))
+    view = SpectatorView(screen, codes, columns)
+
+    for worker in workers:
+        worker.start()
+
+    clock = pygame.time.Clock()
+    try:
+        frame = 0
+        while True:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    return
+            dirty = view.draw()
+            if dirty:
+                pygame.display.update(dirty)
+            clock.tick(fps)
+
+            frame += 1
+            if frame % fps == 0:
+                pygame.display.set_caption('%s (%d games, %.0f fps)' % (title, count, clock.get_fps()))
+    finally:
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.join()
+        pygame.quit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Watch many bot games of 2048 at once.')
+    parser.add_argument('-n', '--games', type=int, default=16, help='number of games to show')
+    parser.add_argument('-s', '--size', type=int, default=960, help='window width in pixels')
+    parser.add_argument('--fps', type=int, default=60, help='target frame rate')
+    parser.add_argument('--delay', type=float, default=0.05, help='seconds between bot moves')
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='random', help='bot move policy')
+    parser.add_argument('--seed', type=int, help='seed for reproducible games')
+    parser.add_argument('-j', '--jobs', type=int, help='number of processes playing, defaults to one per spare core')
+    args = parser.parse_args()
+    run_spectator(args.games, args.size, args.fps, args.delay, args.policy, args.seed, args.jobs)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,11 @@
+import errno
 import os
+import sys
 import tempfile
+from collections import OrderedDict
 
 import pygame
+from appdirs import user_data_dir
 
 # Get the temp file dir.
 tempdir = tempfile.gettempdir()
@@ -12,7 +16,42 @@ def center(total, size):
     return (total - size) / 2
 
 
-def load_font(name, size, cache={}):
+class LRUCache(object):
+    """A mapping that evicts the least recently used entries once it holds more than maxsize."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, key):
+        # Reinsert to mark as most recently used.
+        value = self._data.pop(key)
+        self._data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def clear(self):
+        self._data.clear()
+
+
+def load_font(name, size, cache=LRUCache(64)):
     if (name, size) in cache:
         return cache[name, size]
     if name.startswith('SYS:'):
@@ -26,3 +65,65 @@ def load_font(name, size, cache={}):
 def write_to_disk(file):
     file.flush()
     os.fsync(file.fileno())
+
+
+def read_file(name):
+    """Read a whole file, or return an empty string if it doesn't exist."""
+    try:
+        with open(name) as f:
+            return f.read()
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return ''
+
+
+if hasattr(os, 'replace'):
+    replace_file = os.replace
+elif sys.platform == 'win32':
+    import ctypes
+
+    MOVEFILE_REPLACE_EXISTING = 0x1
+    MOVEFILE_WRITE_THROUGH = 0x8
+
+    def replace_file(source, target):
+        """Rename source to target, replacing it, which os.rename refuses to do on Windows."""
+        encoding = sys.getfilesystemencoding()
+        if isinstance(source, bytes):
+            source = source.decode(encoding)
+        if isinstance(target, bytes):
+            target = target.decode(encoding)
+        if not ctypes.windll.kernel32.MoveFileExW(source, target,
+                                                  MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH):
+            raise ctypes.WinError()
+else:
+    # Renaming replaces the target atomically on POSIX.
+    replace_file = os.rename
+
+
+def atomic_write(name, data):
+    """Replace a file with data, so that a crash leaves either the old or the new contents."""
+    temp = name + '.tmp'
+    with open(temp, 'w') as f:
+        f.write(data)
+        write_to_disk(f)
+    replace_file(temp, name)
+
+    # Make the rename itself durable, where directories can be synced.
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(os.path.dirname(os.path.abspath(name)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def default_data_dir():
+    """Returns the per-user data directory, creating it if needed."""
+    data_dir = user_data_dir(appauthor='Quantum', appname='2048', roaming=True)
+    try:
+        os.makedirs(data_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return data_dir
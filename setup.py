@@ -16,13 +16,23 @@ setup(
     entry_points={
         'console_scripts': [
             '2048 = _2048.main:main',
+            '2048-spectate = _2048.spectator:main',
+            '2048-history = _2048.history:main',
+            '2048-analyze = _2048.analytics:main',
+            '2048-export = _2048.export:main',
+            '2048-evalcache = _2048.evalcache:main',
+            '2048-positions = _2048.positions:main',
+            '2048-selfplay = _2048.selfplay:main',
         ],
         'gui_scripts': [
             '2048w = _2048.main:main'
         ]
 
     },
-    install_requires=['pygame', 'appdirs'],
+    install_requires=['pygame>=2.0', 'appdirs'],
+    extras_require={
+        'gif': ['Pillow'],
+    },
 
     author='quantum',
     author_email='quantum2048@gmail.com',